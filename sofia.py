@@ -1,19 +1,44 @@
 # Revision of 20 Dec 2023
-# The following lines are to enable deletion of a line in a windows command prompt
+import re
 import sys
+import os
+import json
+import hashlib
+import ast
+import time
+from array import array
+from collections import OrderedDict
 from sys import platform
-if platform == "win32":
-    import ctypes
-    kernel32 = ctypes.windll.kernel32
-    kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
-
-showing = False
-
-print('-------------------------------------')
-print('SOFiA Theory') 
-print('Based on SOFiA Version of 20 Dec 2023')
-print('sofia.help() lists basic commands')
-print('-------------------------------------')
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+showing = False    # Whether propositions are printed every time they are updated (unless set per proposition)
+sink = print       # Where propositions send their output: a function taking one line of text, or a logger
+historylimit = None    # Number of step records kept in the history of each new proof (None: all of them)
+
+_console=False
+def _emit(out,text):    # Sends a line of text to a sink
+    global _console
+    if out is print:
+        # The following lines are to enable deletion of a line in a windows command prompt
+        if _console==False and platform == "win32":
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
+        _console=True
+        print(text)
+    elif hasattr(out,'info'):
+        out.info(text)
+    else:
+        out(text)
+def _discard(text):     # The sink of silent propositions
+    pass
+
+def banner():
+    print('-------------------------------------')
+    print('SOFiA Theory') 
+    print('Based on SOFiA Version of 20 Dec 2023')
+    print('sofia.help() lists basic commands')
+    print('-------------------------------------')
 
 #############
 # Glossary: #
@@ -61,6 +86,9 @@ def help():
     print('  ■ Show history: P.showh() will print proposition building history for P.')
     print('  ■ Axiom builders: A=sofia.nat() and A=sofia.bool() define axioms builders. Call A.help() to see how to use them.')
     print('  ■ Mode: include sofia.showing=False in the code if you do not want to print a proposition every time it is updated.')
+    print('  ■ Options: sofia.prop("Prop",["silent"]) never prints anything, sofia.prop("Prop",["showing"]) prints Prop every time it is updated, sofia.prop("Prop",["incremental"]) prints only the new lines of the proof.')
+    print('  ■ Output: sofia.prop("Prop",out=f) sends the lines printed by Prop to the function (or logger) f, as does sofia.sink=f for all propositions.')
+    print('  ■ Theories: T=sofia.theory(); T.ax("A","[X]"); T.t("Thm",[("a","[Y]"),("c","A"),("d",2,[[1,1]]),("s",)]); T.check() verifies the theorems of T in parallel and returns their errors. T.check(cache="lib.json") reuses the theorems verified before.')
     print(' ================')
     print(' Proof building commands. For a given proposition P, the following proof building commands are available.')
     print('  ■ Assumption in a new proof block: P.a("[X]") will assume [X] and step inside a new proof block.')
@@ -72,11 +100,525 @@ def help():
     print('  ■ Apply: P.d(2,[[1,1],[1,2]],3) will apply an implication at line 2, position 3, to variables at line 1, position 1, and line 1, position 2.')
     print('  ■ Left substitution: P.ls(1,2,[3,4],5,6) will substitute the left side of equality at line 1, position 5, in line 2, position 6, replacing occurences 3 and 4 of the right side of the equality.')
     print('  ■ Right substitution: P.rs(1,2,[],5,6) will substitute the right side of equality at line 1, position 5, in line 2, position 6, replacing all occurences of the left side of the equality.')
+    print('  ■ Occurrences: P.occurrences("[x]",2,6) lists the occurrences of [x] in line 2, position 6, as (number, offset, depth); they can be passed to P.ls and P.rs as instances.')
     print('  ■ Delete: P.x() will delete the last line of the proof.')
+    print('  ■ Minimize: Q=P.minimize() returns the theorem proved by P without the lines its statement does not depend on.')
+    print('  ■ Dependency graph: P.graph() returns the lines of P with the earlier lines their steps consumed, P.dot() the same graph in DOT.')
+    print('  ■ History records: P.history("d",errors=True) returns the records of the application steps of P that triggered errors; sofia.historylimit bounds the records kept.')
+    print('  ■ Replay: log=P.export() returns the steps of P with hashes of their lines, sofia.prop().replay(log) makes the proof again from them.')
+    print('  ■ Journal: P.journal("proof.log") keeps writing the proof of P to a file, sofia.prop().recover("proof.log") makes it again from the file.')
+    print('  ■ Parallel check: P.check() verifies the proof of P again, its top-level blocks on worker processes, and returns the errors.')
+    print('  ■ Edit: P.edit(4,("d",2,[[1,1]],3)) will make line 4 by the given step instead, and P.insert(4,("a","[X]")) will insert a line made by the given step before line 4; only the later lines that could change are made again.')
+    print('  ■ Checkpoints: P.checkpoint("A") records the proof as it is, P.restore("A") brings it back; Q=P.fork() returns a copy of P to be continued separately, sharing the lines of P.')
+    print('  ■ Search: sofia.search("[X]",[A,B]) will look for a proof of [X] recalling A and B, and return it as a proposition (or None).')
+    print('  ■ Countermodels: sofia.countermodel("[X]",[A,B]) will look for a finite interpretation where A and B hold but [X] fails, showing that [X] cannot be proved from them (requires numpy).')
 
 def notshowing():
+    global showing
     showing=False
 
+###########################################################################################
+# PARSED STATEMENTS (tree class)                                                          #
+# An expression is parsed once into an immutable tree of constants and sub-statements.    #
+# Each sub-statement is itself a tree. The tree answers the questions the deduction       #
+# steps ask about an expression (outer statements, variables, constants and arguments)    #
+# without scanning the string again.                                                      #
+###########################################################################################
+class tree:
+    __slots__=('text','items','stats','_v','_d','_a','_o','_c')
+    def __init__(self,text,items):
+        self.text=text      # the parsed expression
+        self.items=items    # constants (strings) and sub-statements (trees), in order of appearance
+        self.stats=tuple([x.text for x in items if type(x)==tree])  # outer level statements
+        self._v=None        # cached variables
+        self._d=None        # cached decomposition
+        self._a=None        # cached argument statements
+        self._o=None        # cached occurrences, by the statements looked for
+        self._c=None        # cached canonical forms
+
+    def kids(self):         # Returns the outer level statements as trees
+        return [x for x in self.items if type(x)==tree]
+
+    def shape(self):        # The constants of the expression, with None in place of each statement
+        return tuple([x if type(x)==str else None for x in self.items])
+
+    def isvar(self,lb='[',rb=']'):     # Checks whether the tree is a stated variable
+        return len(self.text)>2 and self.text[0]==lb and self.text[-1]==rb and len(self.items)==1 and type(self.items[0])==str
+
+    def vars(self,lb='[',rb=']'):      # Returns all variables of the expression, in order of appearance
+        if self._v==None:
+            if self.isvar(lb,rb):
+                self._v=(self.items[0],)
+            else:
+                output=[]
+                for x in self.items:
+                    if type(x)==tree:
+                        output.extend(x.vars(lb,rb))
+                self._v=tuple(output)
+        return self._v
+
+    def context(self,lb='[',rb=']'):   # Returns the outer variables of the expression
+        return [x.items[0] for x in self.items if type(x)==tree and x.isvar(lb,rb)]
+
+    def decompose(self):    # Constants and statements of a single statement, see prop._decomposestat
+        if self._d==None:
+            constants=[]
+            states=[]
+            run=''
+            for i in range(0,len(self.items)):
+                x=self.items[i]
+                if type(x)==tree:
+                    if i==0:
+                        constants.append('')
+                    run=run+x.text
+                else:
+                    if run!='':
+                        states.append(run)
+                        run=''
+                    constants.append(x)
+            if run!='':
+                states.append(run)
+            if len(constants)==0:
+                constants.append('')
+            self._d=(constants,states)
+        return [list(self._d[0]),list(self._d[1])]
+
+    def argstats(self,im=':'):   # Statements of a single stated argument, see prop._extractargstat
+        if self._a==None:
+            output=[]
+            stat=''
+            for x in self.items:
+                if type(x)==tree:
+                    stat=stat+x.text
+                else:
+                    for k in range(0,x.count(im)):
+                        output.append(stat)
+                        stat=''
+            output.append(stat)
+            self._a=tuple(output)
+        return list(self._a)
+
+    def occurrences(self,parts):
+        # Returns the occurrences of the consecutive statements parts (a tuple of texts) in the expression, in order
+        # of appearance, as (number, offset, depth): the offset is the position in the text, the depth the number
+        # of brackets enclosing the occurrence. Numbers are those expected by substitute.
+        if self._o==None:
+            self._o={}
+        if parts not in self._o:
+            output=[]
+            self._occurrences(parts,0,0,output)
+            self._o[parts]=tuple(output)
+        return list(self._o[parts])
+
+    def _occurrences(self,parts,pos,depth,output):
+        items=self.items
+        k=len(parts)
+        for j in range(0,len(items)):
+            x=items[j]
+            if type(x)==tree:
+                if x.text==parts[0] and j+k<=len(items):
+                    m=1
+                    while m<k and type(items[j+m])==tree and items[j+m].text==parts[m]:
+                        m=m+1
+                    if m==k:
+                        output.append((len(output)+1,pos,depth))
+                x._occurrences(parts,pos+1,depth+1,output)
+            pos=pos+len(x) if type(x)==str else pos+len(x.text)
+
+    def canonical(self,sp='$',im=':',lb='[',rb=']',top=False):
+        # Canonical form of the expression, the same for all expressions differing only in names of bound variables.
+        # Variables stated at the outer level of a statement or an argument inside the expression (or of the
+        # expression itself, if top) are bound there and renamed sp0, sp1, ... in order; free variables are kept.
+        if self._c==None:
+            self._c={}
+        key=(sp,im,lb,rb,top)
+        if key not in self._c:
+            out=[]
+            _canonical(self.items,{},[0],out,sp,im,lb,rb,top)
+            self._c[key]=''.join(out)
+        return self._c[key]
+
+    def canonicalstats(self,sp='$',im=':',lb='[',rb=']'):
+        # Canonical forms of the outer level statements, each on its own
+        if self._c==None:
+            self._c={}
+        key=(sp,im,lb,rb,None)
+        if key not in self._c:
+            output=[]
+            for x in self.items:
+                if type(x)==tree:
+                    out=[]
+                    _canonical((x,),{},[0],out,sp,im,lb,rb,False)
+                    output.append(''.join(out))
+            self._c[key]=tuple(output)
+        return self._c[key]
+
+    def substitute(self,parts,repl,chosen=None,rb=']'):
+        # Replaces the occurrences of the consecutive statements parts (a tuple of texts) in the expression by repl.
+        # Occurrences are numbered from 1 in order of appearance, overlapping ones included; only those numbered
+        # in chosen are replaced (all if chosen is None), skipping any that overlaps an occurrence replaced before.
+        # Returns the new expression and the number of occurrences.
+        count=[0]
+        out=[]
+        self._substitute(parts,repl,chosen,rb,count,out)
+        return ''.join(out),count[0]
+
+    def _substitute(self,parts,repl,chosen,rb,count,out):    # out is None when only counting occurrences
+        items=self.items
+        k=len(parts)
+        skip=0      # number of the following items covered by a replaced occurrence
+        for j in range(0,len(items)):
+            x=items[j]
+            if type(x)==tree and x.text==parts[0] and j+k<=len(items):
+                m=1
+                while m<k and type(items[j+m])==tree and items[j+m].text==parts[m]:
+                    m=m+1
+                if m==k:
+                    count[0]=count[0]+1
+                    if out!=None and skip==0 and (chosen==None or count[0] in chosen):
+                        out.append(repl)
+                        skip=k
+            if skip>0 or out==None:
+                if type(x)==tree:
+                    x._substitute(parts,repl,chosen,rb,count,None)
+            elif type(x)==str:
+                out.append(x)
+            else:
+                out.append(x.text[0])
+                x._substitute(parts,repl,chosen,rb,count,out)
+                if len(x.text)>1 and x.text[-1]==rb:
+                    out.append(rb)
+            if skip>0:
+                skip=skip-1
+
+_brackets={}
+def _parse(text,lb='[',rb=']'):   # Parses an expression into a tree in a single pass
+    b=_brackets.get(lb+rb)
+    if b==None:
+        b=re.compile('['+re.escape(lb+rb)+']')
+        _brackets[lb+rb]=b
+    stack=[[0,[]]]
+    pos=0
+    for m in b.finditer(text):
+        i=m.start()
+        items=stack[-1][1]
+        if i>pos:
+            _additem(items,text[pos:i])
+        if text[i]==lb:
+            stack.append([i,[]])
+        elif len(stack)>1:
+            start,items=stack.pop()
+            stack[-1][1].append(tree(text[start:i+1],tuple(items)))
+        else:
+            _additem(items,rb)    # an unmatched right bracket is kept as a constant
+        pos=i+1
+    if pos<len(text):
+        _additem(stack[-1][1],text[pos:])
+    while len(stack)>1:          # unmatched left brackets are closed at the end of the text
+        start,items=stack.pop()
+        stack[-1][1].append(tree(text[start:],tuple(items)))
+    return tree(text,tuple(stack[0][1]))
+
+def _canonical(items,names,count,out,sp,im,lb,rb,binds):
+    # Writes the canonical form of a sequence of items to out, where names maps the bound variables to their new names
+    # and binds tells whether the variables stated among the items are bound there
+    if binds:
+        bound={}
+        for x in items:
+            if type(x)==tree and x.isvar(lb,rb) and x.items[0] not in bound:
+                bound[x.items[0]]=sp+str(count[0])
+                count[0]=count[0]+1
+        if len(bound)>0:
+            names=dict(names)
+            names.update(bound)
+    for x in items:
+        if type(x)==str:
+            out.append(x)
+        elif x.isvar(lb,rb):
+            out.append(lb+names.get(x.items[0],x.items[0])+rb)
+        else:
+            binds=True    # the items of a statement or an argument: statements separated by implications only
+            for y in x.items:
+                if type(y)==str and y.replace(im,'')!='':
+                    binds=False
+                    break
+            out.append(x.text[0])
+            _canonical(x.items,names,count,out,sp,im,lb,rb,binds)
+            if len(x.text)>1 and x.text[-1]==rb:
+                out.append(rb)
+
+_variables={}
+def _subvars(text,mapping,lb='[',rb=']'):   # Replaces each stated variable [x] in x's entry of mapping, all at once
+    if len(mapping)==0:
+        return text
+    v=_variables.get(lb+rb)
+    if v==None:
+        v=re.compile(re.escape(lb)+'([^'+re.escape(lb+rb)+']+)'+re.escape(rb))
+        _variables[lb+rb]=v
+    return v.sub(lambda m: mapping.get(m.group(1),m.group(0)),text)
+
+def _additem(items,constant):
+    if len(items)>0 and type(items[-1])==str:
+        items[-1]=items[-1]+constant
+    else:
+        items.append(constant)
+
+class _names:   # Fresh variable names avoiding the given names, as chosen by prop._renamevar
+    __slots__=('taken','pr','pm','ss','_got')
+    def __init__(self,taken,pr="'",pm=3,ss=''):
+        self.taken=taken    # names to avoid (a dictionary, looked up by key)
+        self.pr=pr          # prime, appended to a name up to pm primes in total
+        self.pm=pm
+        self.ss=ss          # subscript symbol, followed by 0,1,2,... once primes run out
+        self._got={}        # fresh name found for each name
+
+    def fresh(self,varname):
+        newname=self._got.get(varname)
+        if newname==None:
+            newname=varname
+            if newname in self.taken and varname[-1]!=self.pr:
+                primecount=varname.count(self.pr)
+                while primecount<self.pm and newname in self.taken:
+                    newname=newname+self.pr
+                    primecount=primecount+1
+            i=0
+            while newname in self.taken:
+                newname=varname+self.ss+str(i)
+                i=i+1
+            self._got[varname]=newname
+        return newname
+
+class _plist:   # A list whose copies share its full chunks, the last (partial) chunk being copied, see prop.fork
+    __slots__=('_full','_tail')
+    _cs=64      # number of items in a full chunk
+    def __init__(self,items=()):
+        self._full=()             # full chunks, as a tuple that copies share
+        self._tail=self._new()    # items after the full chunks
+        for x in items:
+            self.append(x)
+
+    def _new(self,items=()):    # A chunk that can be changed, holding the given items
+        return list(items)
+
+    def _chunk(self,items):    # A full chunk, holding the given items
+        return tuple(items)
+
+    def _like(self):    # An empty list of the same kind
+        return _plist()
+
+    def copy(self):
+        output=self._like()
+        output._full=self._full
+        output._tail=self._new(self._tail)
+        return output
+
+    def append(self,x):
+        self._tail.append(x)
+        if len(self._tail)==self._cs:
+            self._full=self._full+(self._chunk(self._tail),)
+            self._tail=self._new()
+
+    def pop(self):
+        if len(self._tail)==0:
+            self._tail=self._new(self._full[-1])
+            self._full=self._full[:-1]
+        return self._tail.pop()
+
+    def _pos(self,i):    # Chunk and position of item i, None for the tail
+        n=len(self._full)*self._cs
+        if i<0:
+            i=i+n+len(self._tail)
+        if i<0 or i>=n+len(self._tail):
+            raise IndexError('list index out of range')
+        if i>=n:
+            return None,i-n
+        return i//self._cs,i%self._cs
+
+    def __getitem__(self,i):
+        if type(i)==slice:
+            return [self[j] for j in range(*i.indices(len(self)))]
+        k,j=self._pos(i)
+        if k==None:
+            return self._tail[j]
+        return self._full[k][j]
+
+    def __setitem__(self,i,x):
+        k,j=self._pos(i)
+        if k==None:
+            self._tail[j]=x
+        else:
+            chunk=self._new(self._full[k])
+            chunk[j]=x
+            self._full=self._full[:k]+(self._chunk(chunk),)+self._full[k+1:]
+
+    def __len__(self):
+        return len(self._full)*self._cs+len(self._tail)
+
+    def __iter__(self):
+        for chunk in self._full:
+            for x in chunk:
+                yield x
+        for x in list(self._tail):
+            yield x
+
+    def __reversed__(self):
+        for x in reversed(list(self._tail)):
+            yield x
+        for chunk in reversed(self._full):
+            for x in reversed(chunk):
+                yield x
+
+class _array(_plist):    # A _plist of integers, held in arrays of the given type code ('b' up to 127, 'i' up to 2**31-1)
+    __slots__=('_tc',)
+    def __init__(self,typecode,items=()):
+        self._tc=typecode
+        _plist.__init__(self,items)
+
+    def _new(self,items=()):
+        return array(self._tc,items)
+
+    def _chunk(self,items):    # never changed once full, see __setitem__
+        return array(self._tc,items)
+
+    def _like(self):
+        return _array(self._tc)
+
+class _codes(_array):    # A _plist of strings, held as codes in arrays; the strings are kept once for a list and its copies
+    __slots__=('_code','_string')
+    def __init__(self,items=(),table=None):
+        if table==None:
+            table=({},[])
+        self._code=table[0]      # code of each string
+        self._string=table[1]    # string of each code
+        _array.__init__(self,'i',items)    # encoded by append
+
+    def _like(self):    # sharing the strings, which are dropped with the last copy
+        return _codes((),(self._code,self._string))
+
+    def __reduce__(self):    # Pickled by its strings, as codes differ from one process to another
+        return (_codes,(list(self),))
+
+    def _encode(self,x):
+        c=self._code.get(x)
+        if c==None:
+            c=len(self._string)
+            self._string.append(x)
+            self._code[x]=c
+        return c
+
+    def append(self,x):
+        _array.append(self,self._encode(x))
+
+    def pop(self):
+        return self._string[_array.pop(self)]
+
+    def __getitem__(self,i):
+        if type(i)==slice:
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._string[_array.__getitem__(self,i)]
+
+    def __setitem__(self,i,x):
+        _array.__setitem__(self,i,self._encode(x))
+
+    def __iter__(self):
+        for c in _array.__iter__(self):
+            yield self._string[c]
+
+    def __reversed__(self):
+        for c in _array.__reversed__(self):
+            yield self._string[c]
+
+class _history(_plist):    # The history of a proof: a list of step records keeping only the last limit of them
+    __slots__=('_base','_limit','_skip')
+    def __init__(self,records=(),limit=None):
+        self._base=0         # number of records dropped
+        self._limit=limit    # None: all records are kept
+        self._skip=0         # number of records dropped from the first chunk (or the tail), left as None
+        _plist.__init__(self,records)
+
+    def copy(self):
+        output=_history((),self._limit)
+        output._full=self._full
+        output._tail=self._new(self._tail)
+        output._base=self._base
+        output._skip=self._skip
+        return output
+
+    def append(self,x):    # Drops the first record once there are more than limit of them
+        _plist.append(self,x)
+        if self._limit!=None and len(self)>self._limit:
+            if len(self._full)==0:
+                self._tail[self._skip]=None    # not shared with copies, so released at once
+            else:
+                chunk=self._new(self._full[0])
+                chunk[self._skip]=None
+                self._full=(self._chunk(chunk),)+self._full[1:]    # about limit/_cs chunks
+            self._skip=self._skip+1
+            self._base=self._base+1
+            if self._skip==self._cs:
+                self._full=self._full[1:]
+                self._skip=0
+
+    def _pos(self,i):
+        if i<0:
+            i=i+len(self)
+        if i<0 or i>=len(self):
+            raise IndexError('list index out of range')
+        return _plist._pos(self,i+self._skip)
+
+    def __len__(self):
+        return _plist.__len__(self)-self._skip
+
+    def __iter__(self):
+        for k,x in enumerate(_plist.__iter__(self)):
+            if k>=self._skip:
+                yield x
+
+    def __reversed__(self):
+        for k,x in enumerate(_plist.__reversed__(self)):
+            if k<len(self):
+                yield x
+
+    def total(self):    # Number of records appended so far, including those dropped
+        return self._base+len(self)
+
+    def since(self,h):    # The records kept among those appended after the first h
+        return self[max(h-self._base,0):]
+
+    def between(self,h,k):    # The records kept among those appended after the first h and up to the first k
+        return self[max(h-self._base,0):max(k-self._base,0)]
+
+def _copied(x):    # The arguments of a step, with their lists copied (steps may change the lists they are given)
+    if type(x)==list:
+        return [_copied(y) for y in x]
+    if type(x)==tuple:
+        return tuple([_copied(y) for y in x])
+    return x
+
+def _logged(step):    # The step with the propositions it recalls given by their name and statement, see prop.export
+    return tuple([{'prop':x._nam,'statement':x.getstatement()} if type(x)==prop else x for x in step])
+
+def _unlogged(step):    # The step given by _logged, recalling axioms with the same names and statements
+    output=[]
+    for x in step:
+        if type(x)==dict:
+            A=prop(x['prop'],['silent'])
+            A.postulate(x['statement'])
+            x=A
+        output.append(x)
+    return tuple(output)
+
+_logcolumns=('steps','lines','reasons','depths','assumptions','uses','records')    # What each line of a log holds
+
+def _linehash(prev,results):    # Hash of what a line holds in a log (in the order of _logcolumns), chained with prev
+    return hashlib.sha256(json.dumps([prev]+list(results)).encode('utf-8')).hexdigest()
+
+_echoes={'a':'Assumed: ','aa':'Assumtion added: ','ax':'Postulated ','r':'Restatement: ','c':'Recalled ',
+         'e':'Selfequate ','s':'Synapsis','d':'Application: ','ls':'Left substitution: ','rs':'Right substitution: ',
+         'x':'Deleted last line','restore':'Restored checkpoint ','edit':'Edited line ','insert':'Inserted line '}
+_editable=('a','aa','r','c','e','d','ls','rs','s')    # Proof steps that can make a line in edit and insert
+_reasonlines=re.compile(r'(?<=L)\d+|(?<=-)\d+(?=\))|(?<= )\d+(?=[ )])')    # Line numbers in the reason of a line
+
 class prop:
                     #############################################################
     _al='╔'         # Symbols for the bracket proof display                     #
@@ -97,81 +639,291 @@ class prop:
     _v='?'          # Symbol for disjunction    #
     _ep='QED'       # End proof symbol          #
                     #############################
-    def __init__(self,name='Proposition',options=[]):
+    _pc=OrderedDict()    # Parsed expressions, shared by all propositions (bracket symbols fixed)  #
+    _pcm=4096       # Number kept, the least recently used one being dropped for a new one         #
+                    ################################################################################
+    # Error texts
+    _err1=' - inval. expr. at L'
+    _err2=' - inval. stat. at L'
+    _err3=' - inval. line ref. at L'
+    _err4=' - no input for synapsis at L'
+    _err5=' - illigal step for the first line of proof at L'
+    _err6=' - proof interrupted at line L'
+    _err7=' - ref. line is not logically accessible at L'
+    _err8=' - inval. final line'
+    _err9=' - inval. initial line'
+    _err10=' - inval. inference at L'
+    _err11=' - inval. concretization at L'
+    _err12=' - concrization with noncontextual variable at L'
+    _err13=' - cannot equate coupound statement at L'
+    _err14=' - there is reserved meaning for notation at L'
+    _err15=' - variables lost in notation at L'
+    _err16=' - invalid notation introduced at L'
+    _err17=' - unrecognized equality referenced at L'
+    _err18=' - you can only recall a sofia proposition at L'
+    _err19=' - generalization failed or partially succeeded at L'
+    _err20=' - disjunction unconfirmed at L'
+    _err21=' - inval. position ref. at L'
+    _err22=' - cannot contextualize reserved variable at L'
+    _err23=' - cannot reserve a variable at L'
+    _err24=' - void proposition recalled at L'
+    _err25=' - no existing assumptions to add to'
+    _err26=' - missing conclusion for synapsis at L'
+
+    __slots__=('_scoped','_showing','_out','_incremental','_shown','_showsta','_prfnam','_nam','_proptype','_propsta',
+               '_concluded','_lin','_rea','_assdep','_ass','_par','_blk','_bop','_bcl','_bpa','_stk','_acs','_can',
+               '_shp','_cvd','_nvd','_chg','_stp','_use','_curlin','_err','_clock','_jrn','_chk')
+    def __init__(self,name='Proposition',options=[],out=None):
                                     #############################################################################################
         self._scoped=False          # This detemines the way variables are treated:                                             #                       
         if 'scoped' in options:     # scoped = False means that variables are not limited by the formula scope (default opt.)   #
             self._scoped=True       # scoped = True means that variables are limited by the formula scope (not impl. yet)       #
                                     #############################################################################################        
+        self._showing=None          # Whether to print the proposition on each update (None: follow sofia.showing)
+        self._out=out               # Where to send the output (None: sofia.sink)
+        if 'showing' in options:
+            self._showing=True
+        self._incremental=False     # Whether to print only the new line on each update, instead of the whole proof
+        if 'incremental' in options:
+            self._showing=True
+            self._incremental=True
+        if 'silent' in options:
+            self._showing=False
+            self._out=_discard
+        self._shown=None            # Number of proof lines printed last by the incremental display (None: other output since)
+        self._showsta=None          # Statement it printed last
         self._prfnam='Proof'        # Name of the proof and the proposition, can be changed #
         self._nam=name              #########################################################
         self._proptype='Proposition'
 
-        # The main proof data:
-        self._lin=[]     # the sequence of proof lines
-        self._rea=[]     # the sequence of explanations how each proof line was obtained
-        self._assdep=[]  # the sequence of assumption depths for each proof line
-        self._ass=[]  # the sequence of assumption (1)/conclusion (0) indicator for each proof line
+        # The main proof data (shared with forks until changed, see fork):
+        self._lin=_plist()     # the sequence of proof lines
+        self._rea=_codes()     # the sequence of explanations how each proof line was obtained
+        self._assdep=_array('i')  # the sequence of assumption depths for each proof line
+        self._ass=_array('b')  # the sequence of assumption (1)/conclusion (0) indicator for each proof line
+        self._par=_plist()     # the sequence of parsed proof lines (trees), parallel to _lin
+
+        # Assumption blocks: the outermost block 0 holds the lines of depth 0 and is never closed.
+        # Each block is open from its first line up to (excluding) the synapsis line closing it.
+        self._blk=_array('i')     # the sequence of (innermost) blocks of each proof line
+        self._bop=_array('i',[0])    # the first line of each block
+        self._bcl=_plist([None]) # the synapsis line closing each block (None while the block is open)
+        self._bpa=_array('i',[-1])   # the block enclosing each block
+
+        # Context stack: one frame for each open assumption block, the outermost (depth 0) first.
+        # A frame lists [context variables, all variables, assumption lines, first line, block, lines]
+        # of the lines in its block, each variable listed only where it first appears in the stack.
+        self._stk=[[_plist(),_plist(),_plist(),0,0,_plist()]]
+        self._acs={}     # outer level statements of the lines on the stack, with (a tuple of) the lines stating them
+        self._can={}     # the same, by canonical form (up to names of bound variables)
+        self._shp={}     # the same statements (as trees), by the shape of their formula, with their number of lines (tuples)
+        self._cvd={}     # context variables on the stack
+        self._nvd={}     # all variables on the stack
+        self._chg=_plist()     # for each line: [frames pushed, frames popped, context vars added, vars added]
+        self._stp=_plist()     # for each line: (step made, lines used, whether it triggered errors, the numbers of history
+                               # records before and after its records), None if unknown
+        self._use=[]     # lines used by the step being made besides those given in its arguments, see _record
         self._curlin=0   # the index of current line in a proof under construction (subtract one to input in the arrays above)
 
-        # Error texts
-        self._err1=' - inval. expr. at L'
-        self._err2=' - inval. stat. at L'
-        self._err3=' - inval. line ref. at L'
-        self._err4=' - no input for synapsis at L'
-        self._err5=' - illigal step for the first line of proof at L'
-        self._err6=' - proof interrupted at line L'
-        self._err7=' - ref. line is not logically accessible at L'
-        self._err8=' - inval. final line'
-        self._err9=' - inval. initial line'
-        self._err10=' - inval. inference at L'
-        self._err11=' - inval. concretization at L'
-        self._err12=' - concrization with noncontextual variable at L'
-        self._err13=' - cannot equate coupound statement at L'
-        self._err14=' - there is reserved meaning for notation at L'
-        self._err15=' - variables lost in notation at L'
-        self._err16=' - invalid notation introduced at L'
-        self._err17=' - unrecognized equality referenced at L'
-        self._err18=' - you can only recall a sofia proposition at L'
-        self._err19=' - generalization failed or partially succeeded at L'
-        self._err20=' - disjunction unconfirmed at L'
-        self._err21=' - inval. position ref. at L'
-        self._err22=' - cannot contextualize reserved variable at L'
-        self._err23=' - cannot reserve a variable at L'
-        self._err24=' - void proposition recalled at L'
-        self._err25=' - no existing assumptions to add to'
-        self._err26=' - missing conclusion for synapsis at L'
-
         # Auxiliary proof data
-        self._err=[]     # List of errors in the proof (shown when the proof gets printed)
+        # History of the proof (shown by showh): records (rule, arguments, line, error code, seconds) of the steps
+        # made, rule being None for the errors they triggered and '' for entries restored as text by load
+        self._err=_history((),historylimit)
+        self._clock=0.0        # when the step being made started
+        self._jrn=None         # [file, lines between snapshots, lines written since the last one, hashes of the lines], see journal
         self._propsta=''           # Proposition statement 
+        self._concluded=False      # Whether _propsta holds the statement proved by the current proof
+        self._chk={}               # Checkpoints of the proof (forks of the proposition), by name
 
     def show(self):
         self.QED()
 
+    def _shows(self):    # Whether the proposition is printed every time it is updated
+        if self._showing==None:
+            return showing
+        return self._showing
+
+    def _say(self,text):    # Prints a line of text to the output of the proposition
+        self._shown=None
+        if self._out==None:
+            _emit(sink,text)
+        else:
+            _emit(self._out,text)
+
+    def _update(self):    # Displays the proposition after it has been updated, if it is to be shown
+        if self._shows():
+            if self._incremental and self._proptype=='Theorem' and self._curlin>0:
+                self._showlast()
+            else:
+                self.show()
+
+    def _showlast(self):
+        # Prints only the lines added since the last display. If the box characters of the last line printed
+        # changed (e.g. once a block is closed after it), it is corrected in place on a terminal, and printed
+        # again as corrected to any other output. Once the proof is concluded with a statement other than the
+        # one printed last, the name and the statement are printed again after the lines, followed by QED.
+        n=len(self._lin)
+        out=self._out
+        if out==None:
+            out=sink
+        if self._shown==None or self._shown>n:
+            header=self.render()[:4]
+            for x in header:
+                self._say(x)
+            self._shown=0
+            self._showsta=header[2]
+        if self._shown>0:
+            i=self._shown-1
+            line=self._line(i,n)
+            if line!=self._line(i,self._shown):
+                if out is print and sys.stdout.isatty() and self._assdep[i]!=0:    # QED is never printed after it
+                    _emit(out,'\x1b[F\x1b[K'+line)
+                else:
+                    _emit(out,line)
+        for i in range(self._shown,n):
+            _emit(out,self._line(i,n))
+        self._shown=n
+        statement=self._conclude()
+        if statement!=self._showsta and self._assdep[n-1]==0:
+            for x in self.render()[1:3]+[self._ep]:
+                _emit(out,x)
+            self._showsta=statement
+
     def showh(self,onlyreturn=False): 
         # Shows proof history, including errors triggered. If True is passed, only returns the history list 
         if onlyreturn==False:
-            for h in self._err:
-                print(h)
+            for r in self._err:
+                self._say(self._entry(r))
         else:
-            return self._err
+            return [self._entry(r) for r in self._err]
+
+    def errors(self):
+        # Returns the errors triggered in the proof, i.e. the entries of the proof history that report an error
+        return [self._entry(r) for r in self._err if r[3]!=0]
+
+    def history(self,rule=None,line=None,errors=None):
+        # Returns the records of the proof history as dictionaries, with the text showh shows for them. If given,
+        # only the records of the rule(s) (e.g. 'd' or ('ls','rs')) and of the line are returned, and only errors
+        # (if errors is True) or steps (if False). The seconds a step took are None if not known.
+        if type(rule)==str or rule==None:
+            rule=(rule,)
+        output=[]
+        for r in self._err:
+            if rule!=(None,) and r[0] not in rule:
+                continue
+            if (line!=None and r[2]!=line) or (errors!=None and (r[3]!=0)!=errors):
+                continue
+            output.append({'rule':r[0],'arguments':r[1],'line':r[2],'code':r[3],'seconds':r[4],'text':self._entry(r)})
+        return output
+
+    def _echo(self,rule,*args):    # Records a step in the history, as made at the next line
+        self._clock=time.perf_counter()
+        self._err.append((rule,_copied(args),self._curlin+1,0,None))
+
+    def _fail(self,code,line):    # Records the error numbered code, triggered at the given line
+        self._err.append((None,(),line,code,None))
+
+    def _entry(self,r):    # The text of a record of the history
+        rule,args=r[0],r[1]
+        if rule==None:
+            return getattr(self,'_err'+str(r[3]))+str(r[2])
+        if rule=='':
+            return args[0]
+        if rule in ('r','e','ls','rs'):
+            return _echoes[rule]+str(list(args))
+        if rule=='d':
+            return _echoes[rule]+str(list(args[:3]))+(' (auto)' if args[3] else '')
+        if rule in ('edit','insert'):
+            return _echoes[rule]+str(args[0])+': '+str(list(args[1]))
+        return _echoes[rule]+': '.join([str(x) for x in args])
+
+    def dump(self):
+        # Returns the proposition as a dictionary of strings and lists, which can be stored as JSON
+        return {'name':self._nam,'type':self._proptype,'statement':self.getstatement(),'lines':list(self._lin),
+                'reasons':list(self._rea),'depths':list(self._assdep),'assumptions':list(self._ass),'history':self.showh(True)}
+
+    def load(self,data):
+        # Restores a proposition returned by dump, without checking its proof again
+        self._nam=data['name']
+        self._err=_history([('',(h,),None,-1 if h.startswith(' - ') else 0,None) for h in data['history']],historylimit)
+        if data['type']=='Axiom':
+            self._proptype='Axiom'
+            self._propsta=data['statement']
+        elif data['type']=='Theorem':
+            self.t(self._nam)
+            for i in range(0,len(data['lines'])):
+                self._adddep(data['depths'][i],data['assumptions'][i])
+                self._addlin(data['lines'][i])
+                self._rea.append(data['reasons'][i])
+                self._curlin=self._curlin+1
+        if self._jrn!=None:
+            self._snapshot()
+        return self
+
+    def fork(self,name=None):
+        # Returns a copy of the proposition (named name if given) that can be continued independently of it.
+        # The proof lines, their reasons and the history are shared by both until either of them changes, so
+        # forking takes about the same time whatever the length of the proof.
+        P=prop(self._nam)
+        P._scoped=self._scoped
+        P._showing=self._showing
+        P._incremental=self._incremental
+        P._out=self._out
+        P._share(self)
+        P._chk=dict(self._chk)
+        if name!=None:
+            P._nam=name
+        return P
+
+    def checkpoint(self,name):
+        # Records the current state of the proof under the given name, to come back to it with restore
+        self._chk[name]=self.fork()
+        return self
+
+    def restore(self,name):
+        # Brings the proof back to the state recorded by checkpoint(name), which can be restored again later
+        if name not in self._chk:
+            self._say('No checkpoint named '+str(name))
+            return self
+        self._share(self._chk[name])
+        self._err.append(('restore',(name,),None,0,None))
+        if self._jrn!=None:
+            self._snapshot()
+        self._shown=None
+        self._update()
+        return self
+
+    def _share(self,other):    # Takes over the proof of other, sharing its lines and copying the open blocks
+        self._nam=other._nam
+        self._prfnam=other._prfnam
+        self._proptype=other._proptype
+        self._propsta=other._propsta
+        self._concluded=other._concluded
+        self._curlin=other._curlin
+        for x in ('_lin','_rea','_assdep','_ass','_par','_blk','_bop','_bcl','_bpa','_chg','_stp','_err'):
+            setattr(self,x,getattr(other,x).copy())
+        self._stk=[[f[0].copy(),f[1].copy(),f[2].copy(),f[3],f[4],f[5].copy()] for f in other._stk]
+        self._acs=dict(other._acs)
+        self._can=dict(other._can)
+        self._shp={}
+        for x in other._shp:
+            self._shp[x]=dict(other._shp[x])
+        self._cvd=dict(other._cvd)
+        self._nvd=dict(other._nvd)
 
     def getstatement(self):
         if self._proptype=='Axiom':
-            #print('')
-            #print('Axiom: '+self._nam+'.')
-            #print(self._propsta)
-            return self._propsta
-        elif len(self.QED(False))>0:
             return self._propsta
+        elif self._proptype=='Theorem':
+            return self._conclude()
         else:
             return self._lb+self._rb
     def t(self,name='Proposition'):
         self._proptype='Theorem'
         self._propsta=self._lb+self._rb
+        self._concluded=False
     def ax(self,line=''):
-        self._err.append('Postulated '+line)
+        self._err.append(('ax',(line,),None,0,None))
         self.postulate(line)
     def postulate(self,line=''):
         self._proptype='Axiom'
@@ -181,27 +933,523 @@ class prop:
         # Check if the line is a valid expression and a valid statement
         if self._valexp(line)==False:
             line=self._lb+self._rb
-            self._err.append(self._err1+str(self._curlin))
+            self._fail(1,self._curlin)
         elif self._valsta(line)==False:
             line=self._lb+self._rb
-            self._err.append(self._err2+str(self._curlin)) 
+            self._fail(2,self._curlin) 
         
         self._propsta=line
-        if showing:
-            self.show()          
+        self._update()
         return line
     def x(self):
         if self._curlin>0:
-            self._err.append('Deleted last line')
-            self._assdep.pop()
-            self._ass.pop()
-            self._lin.pop()
-            self._rea.pop()
-            self._curlin=self._curlin-1
-            if showing:
-                self.show()
+            self._err.append(('x',(),self._curlin,0,None))
+            self._pop()
+            self._journal(True)
+            self._shown=None
+            self._update()
+        else:
+            self._say('Cannot delete a line in the empty proof')
+    def _pop(self):    # Removes the last line of the proof
+        self._concluded=False
+        self._assdep.pop()
+        self._ass.pop()
+        self._unstack()
+        self._lin.pop()
+        self._par.pop()
+        self._rea.pop()
+        self._stp.pop()
+        self._curlin=self._curlin-1
+    ####### EDITING ##################################################################
+    # A line in the middle of the proof can be made by another step (edit) and a     #
+    # step can be inserted before a line (insert). The lines after it are made again #
+    # by their steps only if they could come out differently, see _rework.            #
+    ##################################################################################
+    def edit(self,lineno,step):
+        # Makes line lineno by the given step instead, e.g. P.edit(4,('d',2,[[1,1]],3)) or P.edit(2,('a','[x]'))
+        self._rework(lineno,tuple(step),False)
+    def insert(self,lineno,step):
+        # Inserts a line made by the given step before line lineno; the later steps refer to the lines they did
+        self._rework(lineno,tuple(step),True)
+
+    def _rework(self,lineno,step,insert):
+        # Remakes the proof from line lineno on. A later line is made again by its step only if it uses a line
+        # that came out differently (as given in its step, or as found by it, e.g. the lines stating the premises
+        # of an application and the lines of a block closed by a synapsis), if its step triggered errors, if it
+        # involves a variable whose occurrences changed (its renaming could change), or if the blocks changed
+        # from some line on. The other lines are taken over as they were, with the records of their steps added
+        # to the history again (renumbered), as replay does.
+        if self._proptype!='Theorem':
+            self._say('Cannot prove an axiom.')
+            return
+        last=self._curlin+1 if insert else self._curlin
+        if type(lineno)!=int or lineno<1 or lineno>last or len(step)==0 or step[0] not in _editable:
+            self._say('Cannot edit line '+str(lineno))
+            return
+        if any(self._stp[i]==None for i in range(lineno-1,self._curlin)):
+            self._say('Cannot edit line '+str(lineno)+': the steps of the lines after it are unknown')
+            return
+        p=lineno-1
+        old=[]
+        while self._curlin>p:
+            old.append((self._lin[-1],self._rea[-1],self._assdep[-1],self._ass[-1],self._stp[-1]))
+            self._pop()
+        old.reverse()
+        def shift(l):    # New number of the line numbered l before
+            return l+1 if insert and l>p else l
+        showing=self._showing
+        self._showing=False
+        journal=self._jrn    # the journal gets a snapshot once the lines are made again
+        self._jrn=None
+        self._err.append(('insert' if insert else 'edit',(lineno,step),lineno,0,None))
+        getattr(self,step[0])(*step[1:])
+        changed={}    # lines that came out differently
+        moved={}      # variables whose occurrences changed, by _varkey
+        replay=self._curlin!=p+1    # whether all later lines are to be made again
+        if insert:
+            if not replay:
+                replay=self._assdep[p]!=(self._assdep[p-1] if p>0 else 0)
+                changed[p]=None
+                moved=self._moved('',p)
+        else:
+            line,reason,depth,ass,record=old.pop(0)
+            if not replay:
+                replay=self._assdep[p]!=depth or self._ass[p]!=ass
+                if self._lin[p]!=line:
+                    changed[p]=None
+                    moved=self._moved(line,p)
+        for line,reason,depth,ass,record in old:
+            s=self._steplines(record[0],shift)
+            uses=[u+1 if insert and u>=p else u for u in record[1]]
+            again=replay or record[2] or (s[0]=='d' and len(s)>4 and s[4])
+            again=again or any(u in changed for u in uses) or (insert and self._curlin==p+1)    # its previous line changed
+            again=again or (insert and s[0]=='s' and len(record[1])>0 and min(record[1])<p)
+            again=again or (len(moved)>0 and any(self._varkey(v) in moved for v in self._stepvars(s,line,uses)))
+            n=self._curlin
+            if again:
+                getattr(self,s[0])(*s[1:])
+                if self._curlin!=n+1 or self._assdep[n]!=depth or self._ass[n]!=ass:
+                    replay=True
+                elif self._lin[n]!=line:
+                    changed[n]=None
+                    moved.update(self._moved(line,n))
+            else:
+                self._adddep(depth,ass)
+                self._addlin(line)
+                self._rea.append(self._renumber(reason,s[0],shift))
+                h=self._err.total()
+                for r in self._err.between(*record[3]):
+                    self._err.append(r if r[0]==None else (r[0],self._steplines((r[0],)+r[1],shift)[1:],n+1)+r[3:])
+                self._stp[n]=(s,tuple(uses),False,(h,self._err.total()))
+                self._curlin=self._curlin+1
+        self._showing=showing
+        self._shown=None
+        self._jrn=journal
+        if journal!=None:
+            self._snapshot()
+        self._update()
+
+    def _record(self,step,n,h):
+        # Records the step that made the last line, n being the number of lines before it and h the number of
+        # history records before it, with default line numbers resolved and with the lines it used, and the time
+        # the step took in its history record
+        use=self._use
+        self._use=[]
+        k=h-self._err.total()+len(self._err)    # position of the record of the step, if still kept
+        if k>=0 and k<len(self._err) and self._err[k][0]!=None:
+            self._err[k]=self._err[k][:4]+(time.perf_counter()-self._clock,)
+        if self._curlin!=n+1:
+            return
+        if step[0]=='r':
+            step=('r',[[n,e[1]] if type(e)==list and len(e)==2 and e[0]==-1 else e for e in step[1]],step[2])
+        elif step[0] in ('e','d') and step[1]==-1:
+            step=(step[0],n)+step[2:]
+        elif step[0] in ('ls','rs'):
+            step=(step[0],n if step[1]==-1 else step[1],n-1 if step[2]==-1 else step[2])+step[3:]
+        lines=[]
+        self._steplines(step,lambda l: lines.append(l-1) or l)
+        lines=[i for i in lines if i>=0 and i<n]+use
+        bad=any(r[3]!=0 for r in self._err.since(h))
+        self._stp[n]=(step,tuple(sorted(dict.fromkeys(lines))),bad,(h,self._err.total()))
+        self._journal()
+
+    def _steplines(self,step,f):    # The step with each line number l in its arguments replaced by f(l)
+        kind=step[0]
+        def pairs(x):
+            if type(x)!=list:
+                return x
+            return [[f(e[0])]+e[1:] if type(e)==list and len(e)==2 and type(e[0])==int else e for e in x]
+        if kind=='r':
+            return ('r',pairs(step[1]))+step[2:]
+        if kind=='e':
+            return ('e',f(step[1]))+step[2:]
+        if kind=='d':
+            return ('d',f(step[1]),pairs(step[2]))+step[3:]
+        if kind=='ls' or kind=='rs':
+            return (kind,f(step[1]),f(step[2]))+step[3:]
+        return step
+
+    def _stepvars(self,step,line,uses):    # The variables a step may involve, in its line, arguments and lines used
+        output=list(self._vars(line))
+        for x in step[1:]:
+            if type(x)==str:
+                output.extend(self._vars(x))
+            elif type(x)==prop:
+                output.extend(self._vars(x.getstatement()))
+            elif type(x)==list:
+                output.extend([v for v in x if type(v)==str])
+        for u in uses:
+            if u<len(self._lin):
+                output.extend(self._vars(self._lin[u]))
+        return output
+
+    def _moved(self,old,i):
+        # Keys of the variables (and context variables) in only one of the last line i and its version old, leaving
+        # out those that other lines on the stack state anyway
+        new=self._lin[i]
+        c=self._chg[i]
+        f=self._stk[-1]
+        output={}
+        for a,b,stacked,own in ((self._vars(old),self._vars(new),self._nvd,f[1][len(f[1])-c[3]:]),
+                                (self._statcontext(old),self._statcontext(new),self._cvd,f[0][len(f[0])-c[2]:])):
+            a=dict.fromkeys(a)
+            b=dict.fromkeys(b)
+            own=dict.fromkeys(own)
+            for v in a:
+                if v not in b and v not in stacked:
+                    output[self._varkey(v)]=None
+            for v in b:
+                if v not in a and v in own:
+                    output[self._varkey(v)]=None
+        return output
+
+    def _varkey(self,v):    # A variable name without the primes and subscripts that renaming may add
+        if self._ss!='':
+            v=v.split(self._ss)[0]
+        else:
+            v=v.rstrip('0123456789')
+        return v.rstrip(self._pr)
+
+    def _renumber(self,reason,kind,shift):    # The reason of a line with the line numbers it refers to shifted
+        if kind not in ('r','e','d','ls','rs','s'):
+            return reason
+        head,sep,tail=reason.partition(' (with concretization ')
+        return _reasonlines.sub(lambda m: str(shift(int(m.group(0)))),head)+sep+tail
+    ####### MINIMIZING ###############################################################
+    # minimize makes the proof again from the lines the statement proved depends on, #
+    # dropping the others, see _needed.                                              #
+    ##################################################################################
+    def minimize(self,name=None):
+        # Returns a theorem (named name if given) proving the same statement by the steps of the lines it depends
+        # on, with their line numbers renumbered. The new proof is checked: it must state the same statement (up
+        # to names of bound variables) and its lines must trigger the errors triggered by them before, if any.
+        # If it does not, or the steps of the proof are unknown, a copy of the proposition is returned.
+        if self._proptype!='Theorem' or self._curlin==0 or any(x==None for x in self._stp):
+            return self.fork(name)
+        keep=sorted(self._needed())
+        number={}
+        for i in keep:
+            number[i+1]=len(number)+1
+        P=prop(self._nam if name==None else name,['silent'])
+        P.t(P._nam)
+        for i in keep:
+            step=self._steplines(self._stp[i][0],lambda l: number.get(l,0 if l>0 else l))
+            getattr(P,step[0])(*step[1:])
+        if P._curlin!=len(keep) or any(P._stp[k][2]!=self._stp[keep[k]][2] for k in range(0,len(keep))):
+            return self.fork(name)
+        if P._canon(P.getstatement(),True)!=self._canon(self.getstatement(),True):
+            return self.fork(name)
+        P._scoped=self._scoped
+        P._showing=self._showing
+        P._incremental=self._incremental
+        P._out=self._out
+        P._shown=None
+        return P
+
+    def _needed(self):
+        # The lines the statement proved depends on: the last line, the lines used by the steps of those needed,
+        # the first lines stating their context variables, and the assumptions and synapsis of their blocks.
+        # A synapsis needs only the assumptions and the last line of its block.
+        output={}
+        assumptions={}    # assumption lines of each block
+        todo=[self._curlin-1]
+        while len(todo)>0:
+            i=todo.pop()
+            if i in output:
+                continue
+            output[i]=None
+            step=self._stp[i][0]
+            todo.extend(self._consumed(i))
+            for v in dict.fromkeys(self._stepvars(step,self._lin[i],[])):
+                for j in range(0,i):
+                    if v in self._par[j].context(self._lb,self._rb) and self._logdep(j,i-1):
+                        todo.append(j)
+                        break
+            b=self._blk[i]
+            while b>0:
+                if b not in assumptions:
+                    end=self._curlin if self._bcl[b]==None else self._bcl[b]
+                    assumptions[b]=[j for j in range(self._bop[b],end) if self._blk[j]==b and self._ass[j]==1]
+                todo.extend(assumptions[b])
+                if self._bcl[b]!=None:
+                    todo.append(self._bcl[b])
+                b=self._bpa[b]
+        return output
+
+    def _consumed(self,i):
+        # The earlier lines consumed by the step of line i (None if the step is unknown). A synapsis consumes only
+        # the assumptions and the last line of its block.
+        if self._stp[i]==None:
+            return None
+        step,uses=self._stp[i][:2]
+        if step[0]=='s':
+            return [u for u in uses if self._ass[u]==1]+[i-1]
+        return list(uses)
+    ####### LOGGING ##################################################################
+    # A proof can be exported as the log of the steps of its lines (export) and made #
+    # again from it (replay), taking over the lines the hashes of which still match. #
+    # journal keeps such a log in a file while the proof is made, see recover.       #
+    ##################################################################################
+    def export(self):
+        # Returns the proof as a log of its steps, a dictionary of strings and lists which can be stored as JSON and
+        # made again by replay: for each line, the step that made it, what it made (the line, its reason, depth,
+        # assumption flag and the lines it used), the history records of the step still kept (see historylimit),
+        # and a hash of all of these chained with the hash of the line before it. Recalled propositions are logged
+        # by name and statement.
+        data={'name':self._nam,'type':self._proptype,'statement':self.getstatement(),'hashes':[]}
+        for x in _logcolumns:
+            data[x]=[]
+        prev=''
+        for i in range(0,self._curlin):
+            results=self._results(i)
+            for k in range(0,len(_logcolumns)):
+                data[_logcolumns[k]].append(results[k])
+            prev=_linehash(prev,results)
+            data['hashes'].append(prev)
+        return data
+
+    def _results(self,i):    # What line i holds in a log, in the order of _logcolumns
+        if self._stp[i]==None:
+            step,uses,records=None,[],[]
         else:
-            print('Cannot delete a line in the empty proof')
+            step=list(_logged(self._stp[i][0]))
+            uses=list(self._stp[i][1])
+            records=[[r[0],list(r[1]),r[2],r[3]] for r in self._err.between(*self._stp[i][3])]
+        return [step,self._lin[i],self._rea[i],self._assdep[i],self._ass[i],uses,records]
+
+    def replay(self,data):
+        # Makes the proof of a log returned by export again, e.g. P=sofia.prop().replay(log). A line is taken over
+        # as logged, without checking it, if its hash matches what it holds and the hashes of the lines before it.
+        # Otherwise its step is made again, and so are the steps after it unless they come out as logged. The
+        # history made holds the records of the steps of the lines. Replay stops at a step that is not a proof
+        # step (see _editable), as a log may have been written by hand.
+        self._nam=data['name']
+        if data['type']=='Axiom':
+            self._proptype='Axiom'
+            self._propsta=data['statement']
+        elif data['type']=='Theorem':
+            self.t(self._nam)
+            showing=self._showing
+            self._showing=False
+            journal=self._jrn
+            self._jrn=None
+            prev=''
+            for i in range(0,len(data['lines'])):
+                results=[data[x][i] for x in _logcolumns]
+                if results[0]!=None and (type(results[0])!=list or len(results[0])==0 or results[0][0] not in _editable):
+                    self._say('Cannot replay line '+str(i+1)+': '+str(results[0])+' is not a proof step')
+                    break
+                if self._curlin==i and _linehash(prev,results)==data['hashes'][i]:
+                    self._takeover(*results)
+                    prev=data['hashes'][i]
+                    continue
+                if self._curlin==i and results[0]!=None:
+                    step=_unlogged(results[0])
+                    getattr(self,step[0])(*step[1:])
+                if self._curlin!=i+1:
+                    self._say('Cannot replay line '+str(i+1))
+                    break
+                prev=_linehash(prev,self._results(i))
+            self._showing=showing
+            self._shown=None
+            self._jrn=journal
+            if journal!=None:
+                self._snapshot()
+            self._update()
+        return self
+
+    def _takeover(self,step,line,reason,depth,ass,uses,records):    # Adds a line as held in a log
+        self._adddep(depth,ass)
+        self._addlin(line)
+        self._rea.append(reason)
+        h=self._err.total()
+        for r in records:
+            self._err.append((r[0],tuple(r[1]),r[2],r[3],None))
+        if step!=None:
+            self._stp[self._curlin]=(_unlogged(step),tuple(uses),any(r[3]!=0 for r in records),(h,self._err.total()))
+        self._concluded=False
+        self._curlin=self._curlin+1
+
+    def journal(self,path=None,every=256):
+        # From now on writes the proof to the file path as it is made, to be rebuilt by recover (e.g. after a crash).
+        # The file holds the log of the proof (as returned by export) as a snapshot, followed by a line of JSON for
+        # each line made or deleted after it. A new snapshot replaces the file after every that many such lines,
+        # and whenever lines are changed otherwise (by edit, insert, restore, load or replay). journal() stops it.
+        if path==None:
+            self._jrn=None
+        else:
+            self._jrn=[path,every,0,[]]
+            self._snapshot()
+        return self
+
+    def recover(self,path):
+        # Makes the proof written to the file path by journal again with replay; a last line written partly is ignored
+        with open(path,encoding='utf-8') as f:
+            text=f.read().split('\n')
+        data=json.loads(text[0])
+        for x in text[1:]:
+            try:
+                event=json.loads(x)
+            except ValueError:
+                break
+            if 'deleted' in event:
+                for k in _logcolumns+('hashes',):
+                    data[k].pop()
+            else:
+                for k in range(0,len(_logcolumns)):
+                    data[_logcolumns[k]].append(event['line'][k])
+                data['hashes'].append(event['hash'])
+        return self.replay(data)
+
+    def _snapshot(self):    # Replaces the journal file by the log of the proof
+        data=self.export()
+        with open(self._jrn[0]+'.tmp','w',encoding='utf-8') as f:
+            json.dump(data,f)
+            f.write('\n')
+        os.replace(self._jrn[0]+'.tmp',self._jrn[0])
+        self._jrn[2]=0
+        self._jrn[3]=data['hashes']
+
+    def _journal(self,deleted=False):    # Writes the last line made (or that the last line was deleted) to the journal
+        if self._jrn==None:
+            return
+        if self._jrn[2]>=self._jrn[1]:
+            self._snapshot()
+            return
+        hashes=self._jrn[3]
+        if deleted:
+            hashes.pop()
+            event={'deleted':1}
+        else:
+            results=self._results(self._curlin-1)
+            hashes.append(_linehash(hashes[-1] if len(hashes)>0 else '',results))
+            event={'line':results,'hash':hashes[-1]}
+        with open(self._jrn[0],'a',encoding='utf-8') as f:
+            f.write(json.dumps(event)+'\n')
+        self._jrn[2]=self._jrn[2]+1
+    ####### DEPENDENCY GRAPH #########################################################
+    # The lines of a proof and the earlier lines consumed by their steps form a      #
+    # directed acyclic graph (graph, dot). The blocks at the top level of the proof  #
+    # only consume the lines before them, so check verifies them on their own.       #
+    ##################################################################################
+    def graph(self):
+        # Returns the dependency graph of the proof as a dictionary of strings and lists, which can be stored as
+        # JSON: the lines with their statement, reason, depth and block, and an edge [j,i] whenever the step of
+        # line i consumed line j. Lines whose step is unknown (e.g. restored by load) have no incoming edges.
+        nodes=[]
+        edges=[]
+        for i in range(0,self._curlin):
+            nodes.append({'line':i+1,'statement':self._lin[i],'reason':self._rea[i],'depth':self._assdep[i],
+                          'block':self._blk[i],'bad':self._stp[i]!=None and self._stp[i][2]})
+            for j in sorted(dict.fromkeys(self._consumed(i) or [])):
+                edges.append([j+1,i+1])
+        return {'name':self._nam,'nodes':nodes,'edges':edges}
+
+    def dot(self):
+        # Returns the dependency graph of the proof in the DOT language of Graphviz, with blocks as clusters
+        g=self.graph()
+        output=['digraph '+json.dumps(g['name'])+' {','  node [shape=box];']
+        depth=0
+        for n in g['nodes']:
+            while depth>n['depth']:
+                output.append('  '*depth+'}')
+                depth=depth-1
+            while depth<n['depth']:
+                depth=depth+1
+                output.append('  '*depth+'subgraph cluster_'+str(n['line'])+'_'+str(depth)+' {')
+            label=str(n['line'])+'. '+n['statement']+'   '+n['reason']
+            output.append('  '*(depth+1)+str(n['line'])+' [label='+json.dumps(label)+(', color=red' if n['bad'] else '')+'];')
+        while depth>0:
+            output.append('  '*depth+'}')
+            depth=depth-1
+        for e in g['edges']:
+            output.append('  '+str(e[0])+' -> '+str(e[1])+';')
+        output.append('}')
+        return '\n'.join(output)
+
+    def check(self,workers=None):
+        # Verifies the proof again by the steps of its lines and returns the errors triggered, as errors does for a
+        # proof whose lines are made again as they are. The blocks at the top level are verified independently on
+        # that many worker processes (as many as CPUs if None, none if 0), each from the lines before it, and the
+        # other lines in between likewise, so a line that comes out differently is reported instead.
+        if self._proptype!='Theorem':
+            return []
+        parts=[]    # [first line, line after the last, whether it is a block]
+        i=0
+        while i<self._curlin:
+            b=self._blk[i]
+            if b>0 and self._bpa[b]==0 and self._bop[b]==i and self._bcl[b]!=None:
+                parts.append([i,self._bcl[b]+1,True])
+            elif len(parts)>0 and parts[-1][2]==False:
+                parts[-1][1]=i+1
+            else:
+                parts.append([i,i+1,False])
+            i=parts[-1][1]
+        data=self.dump()
+        data['history']=[]
+        jobs=[]
+        for part in parts:
+            steps=[]
+            for k in range(part[0],part[1]):
+                if self._stp[k]==None:
+                    steps=None
+                    break
+                steps.append(_logged(self._stp[k][0]))
+            prefix=dict(data)
+            for x in ('lines','reasons','depths','assumptions'):
+                prefix[x]=data[x][:part[0]]
+            jobs.append((prefix,steps))
+        results=[None]*len(jobs)
+        pool=None
+        if workers!=0 and len(jobs)>1:
+            pool=ProcessPoolExecutor(workers)
+        try:
+            running={}
+            for k in range(0,len(jobs)):
+                if jobs[k][1]==None:
+                    continue
+                if pool==None:
+                    results[k]=_checkpart(*jobs[k])
+                else:
+                    running[pool.submit(_checkpart,*jobs[k])]=k
+            for future in running:
+                results[running[future]]=future.result()
+        finally:
+            if pool!=None:
+                pool.shutdown()
+        output=[]
+        for k in range(0,len(parts)):
+            start,end=parts[k][:2]
+            if results[k]==None:
+                output.append(' - line '+str(start+1)+' cannot be checked again, its step is unknown')
+                continue
+            lines,history=results[k]
+            output.extend(h for h in history if h.startswith(' - '))
+            for i in range(start,end):
+                made=lines[i-start] if i-start<len(lines) else None
+                if made!=[self._lin[i],self._rea[i],self._assdep[i],self._ass[i],self._stp[i][2]]:
+                    output.append(' - line '+str(i+1)+' comes out differently when checked again')
+        return output
     ####### Deduction step: ASSUME ##################################################
     # An assumption can be any statement whatsoever.                                #
     # If a reserved variable is stated in the assumption, it will be renamed.       #                       
@@ -210,50 +1458,50 @@ class prop:
         # The assumption proof steps. Adds assumption in a new proof block if second variable is False. 
         # Else, adds assumption to the same block.
         if self._proptype=='Theorem':
+            n,h=self._curlin,self._err.total()
             if self._curlin==0 and upperassumption==True:
                 upperassumption=False
             if upperassumption==False:            
-                self._err.append('Assumed: '+assumption)
+                self._echo('a',assumption)
                 self.assume(assumption)
-                if showing:
-                    self.show()
+                self._record(('a',assumption,upperassumption),n,h)
+                self._update()
             elif upperassumption==True:
-                self._err.append('Assumtion added: '+assumption)
+                self._echo('aa',assumption)
                 self.assumeadd(assumption)
-                if showing:
-                    self.show()                
+                self._record(('a',assumption,upperassumption),n,h)
+                self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def aa(self,assumption=''):
         # The assumption proof steps. Adds assumption in a new proof block if second variable is False. 
         # Else, adds assumption to the same block.
         upperassumption=True
         if self._proptype=='Theorem':
+            n,h=self._curlin,self._err.total()
             if self._curlin==0 and upperassumption==True:
                 upperassumption=False
             if upperassumption==False:            
-                self._err.append('Assumed: '+assumption)
+                self._echo('a',assumption)
                 self.assume(assumption)
-                if showing:
-                    self.show()
+                self._record(('aa',assumption),n,h)
+                self._update()
             elif upperassumption==True:
-                self._err.append('Assumtion added: '+assumption)
+                self._echo('aa',assumption)
                 self.assumeadd(assumption)
-                if showing:
-                    self.show()                
+                self._record(('aa',assumption),n,h)
+                self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def assume(self,assumption=''):
         if assumption=='':
             assumption=self._lb+self._rb
 
         # Determine assumption depth of the new line (increment by one)
         if self._curlin==0:
-            self._assdep.append(1)
-            self._ass.append(1)
+            self._adddep(1,1)
         else:
-            self._ass.append(1)
-            self._assdep.append(self._assdep[self._curlin-1]+1)
+            self._adddep(self._assdep[self._curlin-1]+1,1)
         
         self._rea.append('assumption')
 
@@ -263,12 +1511,12 @@ class prop:
         # Check if the assumption is a valid expression and a valid statement
         if self._valexp(assumption)==False:
             assumption=self._lb+self._rb
-            self._err.append(self._err1+str(self._curlin))        
+            self._fail(1,self._curlin)        
         elif self._valsta(assumption)==False:
             assumption=self._lb+self._rb
-            self._err.append(self._err2+str(self._curlin)) 
+            self._fail(2,self._curlin) 
         # Add line to the proof
-        self._lin.append(self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),assumption))
+        self._addlin(self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),assumption))
 
     def assumeadd(self,assumption=''):
         if assumption=='':
@@ -276,11 +1524,9 @@ class prop:
 
         # Determine assumption depth of the new line (increment by one)
         if self._curlin==0:
-            self._assdep.append(1)
-            self._ass.append(1)
+            self._adddep(1,1)
         else:
-            self._ass.append(1)
-            self._assdep.append(self._assdep[self._curlin-1])
+            self._adddep(self._assdep[self._curlin-1],1)
         
         self._rea.append('assumption')
 
@@ -290,12 +1536,12 @@ class prop:
         # Check if the assumption is a valid expression and a valid statement
         if self._valexp(assumption)==False:
             assumption=self._lb+self._rb
-            self._err.append(self._err1+str(self._curlin))        
+            self._fail(1,self._curlin)        
         elif self._valsta(assumption)==False:
             assumption=self._lb+self._rb
-            self._err.append(self._err2+str(self._curlin)) 
+            self._fail(2,self._curlin) 
         # Add line to the proof
-        self._lin.append(self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),assumption))
+        self._addlin(self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),assumption))
 
         #ascont=self._statcontext(assumption)
         #alldepvar=self._noncont(self._curlin-1)
@@ -322,22 +1568,21 @@ class prop:
         # The following ensures that different variables are not assigned the same name in a restate
         newvars = list(dict.fromkeys(newvars))
         if self._proptype=='Theorem': 
-            self._err.append('Restatement: '+str([instance,newvars]))
+            n,h=self._curlin,self._err.total()
+            self._echo('r',instance,newvars)
             self.rest(instance,newvars)
-            if showing:
-                self.show()
+            self._record(('r',instance,newvars),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def rest(self,instance=[],newvars=[]):
         # The following makes lineno argument optional - default value being current line
         new=''
         reason=''
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
         for e in instance:
             if len(e)==2:
                 lineno=e[0]
@@ -345,23 +1590,23 @@ class prop:
                 if lineno==-1:
                     lineno=self._curlin
                 if self._curlin==0:
-                    self._err.append(self._err5+str(self._curlin+1))
+                    self._fail(5,self._curlin+1)
                 elif lineno<0 or lineno>len(self._lin):
-                    self._err.append(self._err3+str(self._curlin+1))
+                    self._fail(3,self._curlin+1)
                 elif lineno!=0 and self._logdep(lineno-1,self._curlin-1)==False:
-                    self._err.append(self._err7+str(self._curlin+1))    
+                    self._fail(7,self._curlin+1)    
                 else:
                     if lineno!=0:
                         reason=reason+' '+str(lineno)    # Add reasoning for the line
                     if lineno>self._curlin or lineno==0:
                         new=new+''
                     else:
-                        s=self._extractstat(self._lin[lineno-1])
+                        s=self._par[lineno-1].stats
                         if ref<len(s)+1 and ref>0:
                             newline=s[ref-1]
                         elif ref!=-1:
                             ref=-1
-                            new=new+''                
+                            newline=''
                         else:
                             newline=self._lin[lineno-1]
                         if newvars!=[]:
@@ -373,18 +1618,14 @@ class prop:
                                 if x not in contextvars and x not in nlvars:
                                     noncontnewvars.append(x)
                             if len(noncontnewvars)!=len(newvars):
-                                self._err.append(self._err23+str(self._curlin+1))
+                                self._fail(23,self._curlin+1)
                             else:
                               nlreplvars=[]
                               for i in range(0,len(nlvars)):
                                   if nlvars[i] not in contextvars and nlvars[i] not in nlcontvars:
                                       nlreplvars.append(nlvars[i])
-                              for i in range(0,len(nlreplvars)):
-                                  if i<len(newvars):
-                                      newline=newline.replace(self._lb+nlreplvars[i]+self._rb,self._lb+newvars[i]+self._rb)
-                                  else:
-                                      i=len(nlreplvars)
-                            new=new+newline                    
+                              newline=self._rename(newline,nlreplvars,newvars)
+                        new=new+newline                    
         # Set assumption depth of the new line   
         if reason=='':
             self._rea.append('restatement (void)')
@@ -393,7 +1634,7 @@ class prop:
             self._rea.append('restatement (see lines'+reason+')')    # Add reasoning for the line
         if new=='':
             new=self._lb+self._rb
-        self._lin.append(new)
+        self._addlin(new)
         self._curlin=self._curlin+1
         # Return new line index
         return self._curlin    
@@ -415,33 +1656,31 @@ class prop:
             self._rea.append('empty formula stated')
         # Check if the line reference is valid and return errors if not
         if self._curlin==0:
-            self._err.append(self._err5+str(self._curlin+1))
+            self._fail(5,self._curlin+1)
         elif lineno<0 or lineno>len(self._lin):
-            self._err.append(self._err3+str(self._curlin+1))
+            self._fail(3,self._curlin+1)
         elif lineno!=0 and self._logdep(lineno-1,self._curlin-1)==False:
-            self._err.append(self._err7+str(self._curlin+1))    
+            self._fail(7,self._curlin+1)    
 
         # Set assumption depth of the new line   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
 
         # Update current line index
         self._curlin=self._curlin+1     
 
         # Add a line to the proof
         if lineno>self._curlin-1 or lineno==0:
-            self._lin.append(self._lb+self._rb)
+            self._addlin(self._lb+self._rb)
         else:
-            s=self._extractstat(self._lin[lineno-1])
+            s=self._par[lineno-1].stats
             if ref<len(s)+1 and ref>0:
                 newline=s[ref-1]
             elif ref!=-1:
                 ref=-1
-                self._err.append(self._err21+str(self._curlin))                
+                self._fail(21,self._curlin)                
             else:
                 newline=self._lin[lineno-1]
             if newvars!=[]:
@@ -453,17 +1692,13 @@ class prop:
                     if x not in contextvars and x not in nlvars:
                         noncontnewvars.append(x)
                 if len(noncontnewvars)!=len(newvars):
-                    self._err.append(self._err23+str(self._curlin))
+                    self._fail(23,self._curlin)
                 nlreplvars=[]
                 for i in range(0,len(nlvars)):
                     if nlvars[i] not in contextvars and nlvars[i] not in nlcontvars:
                         nlreplvars.append(nlvars[i])
-                for i in range(0,len(nlreplvars)):
-                    if i<len(newvars):
-                        newline=newline.replace(self._lb+nlreplvars[i]+self._rb,self._lb+newvars[i]+self._rb)
-                    else:
-                        i=len(nlreplvars)
-            self._lin.append(newline)
+                newline=self._rename(newline,nlreplvars,newvars)
+            self._addlin(newline)
         # Return new line index
         return self._curlin
     ####### Deduction step: RECALL ##################################################
@@ -471,33 +1706,32 @@ class prop:
     #################################################################################
     def c(self,pro=''):
         if self._proptype=='Theorem': 
+            n,h=self._curlin,self._err.total()
             if type(pro)==prop:
-                self._err.append('Recalled '+pro._nam+': '+pro._propsta)
+                self._echo('c',pro._nam,pro.getstatement())
             else:
-                self._err.append('Recalled '+pro)
+                self._echo('c',pro)
             self.recall(pro)
-            if showing:
-                self.show()
+            self._record(('c',pro),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
 
     def recall(self,pro=''):
         # Set assumption depth of the new line   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
 
         # Add a line to the proof
         if type(pro)==prop:
             self._rea.append('recalling '+pro._nam)    # Add reasoning for the line 
-            self._lin.append(self._revisestat([],self._noncont(self._curlin),self._resolve([self._statfromformulas(self._cont(self._curlin)),pro.getstatement()],[])[1]))
+            self._addlin(self._revisestat([],self._noncont(self._curlin),self._resolve([self._statfromformulas(self._cont(self._curlin)),pro.getstatement()],[])[1]))
         else:
             self._rea.append('recall (void)') 
-            self._lin.append(self._lb+self._rb)
-            self._err.append(self._err18+str(self._curlin+1))
+            self._addlin(self._lb+self._rb)
+            self._fail(18,self._curlin+1)
 
         # Update current line index
         self._curlin=self._curlin+1     
@@ -510,12 +1744,13 @@ class prop:
     ##########################################################################
     def e(self,lineno=-1,ref=-1):
         if self._proptype=='Theorem': 
-            self._err.append('Selfequate '+str([lineno,ref]))
+            n,h=self._curlin,self._err.total()
+            self._echo('e',lineno,ref)
             self.selfequate(lineno,ref)
-            if showing:
-                self.show()
+            self._record(('e',lineno,ref),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def selfequate(self,lineno=-1,ref=-1):
         # The following makes lineno argument optional - default value being current line
         if lineno==-1:
@@ -523,41 +1758,39 @@ class prop:
 
         # Set assumption depth of the new line   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
 
         # Update current line index
         self._curlin=self._curlin+1     
 
         if lineno<1 or lineno>len(self._lin):
-            self._lin.append(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
+            self._addlin(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
             self._rea.append('self-equate (void)')    # Add reasoning for the line
-            self._err.append(self._err3+str(self._curlin))
+            self._fail(3,self._curlin)
         elif self._logdep(lineno-1,self._curlin-2)==False:
-            self._lin.append(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
+            self._addlin(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
             self._rea.append('self-equate (void)')    # Add reasoning for the line
-            self._err.append(self._err7+str(self._curlin))
+            self._fail(7,self._curlin)
         else:
             # Check if the line reference is valid and return errors if not
             if ref==-1:
                 ref=1
             # Add a line to the proof
             if lineno>self._curlin-1 or lineno<1:
-                self._lin.append(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
+                self._addlin(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
                 self._rea.append('self-equate (void)')    # Add reasoning for the line
-                self._err.append(self._err3+str(self._curlin))
+                self._fail(3,self._curlin)
             else:
-                s=self._extractstat(self._lin[lineno-1])
+                s=self._par[lineno-1].stats
                 if ref<len(s)+1 and 0<ref:
                     self._rea.append('self-equate from L'+str(lineno)+'('+str(ref)+')')    # Add reasoning for the line
-                    self._lin.append(self._lb+s[ref-1]+self._eq+s[ref-1]+self._rb)
+                    self._addlin(self._lb+s[ref-1]+self._eq+s[ref-1]+self._rb)
                 else:
-                    self._err.append(self._err21+str(self._curlin))
+                    self._fail(21,self._curlin)
                     self._rea.append('self-equate (void)')
-                    self._lin.append(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
+                    self._addlin(self._lb+self._lb+self._rb+self._eq+self._lb+self._rb+self._rb)
         return self._curlin    
     ####### Deduction step: SYNAPSIS ############################################################
     # This is the deduction step of 'stepping out' from an assumption block.                    #
@@ -569,50 +1802,44 @@ class prop:
     #############################################################################################
     def s(self):
         if self._proptype=='Theorem': 
-            self._err.append('Synapsis')
+            n,h=self._curlin,self._err.total()
+            self._echo('s')
             self.synapsis()
-            if showing:
-                self.show()
+            self._record(('s',),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
 
     def synapsis(self):
         if len(self._assdep)==0:
-            self._assdep.append(0)
-            self._ass.append(0)
-            self._err.append(self._err4+str(self._curlin+1))
-            self._lin.append(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
+            self._adddep(0,0)
+            self._fail(4,self._curlin+1)
+            self._addlin(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
             self._rea.append('synapsis (void)')
             self._curlin=self._curlin+1
         elif self._assdep[self._curlin-1]==0:
-            self._assdep.append(0)
-            self._ass.append(0)
-            self._err.append(self._err4+str(self._curlin+1))         
-            self._lin.append(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
+            self._adddep(0,0)
+            self._fail(4,self._curlin+1)         
+            self._addlin(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
             self._rea.append('synapsis (void)')
             self._curlin=self._curlin+1
         elif self._ass[self._curlin-1]==1:
-            self._err.append(self._err25+str(self._curlin+1))    
+            self._fail(25,self._curlin+1)    
         else:
-            self._assdep.append(self._assdep[self._curlin-1]-1)
-            self._ass.append(0)
-            # Determine the starting line of the assumption block
-            i=self._curlin-1
-            while self._assdep[i]+1>self._assdep[self._curlin-1] and i>0:
-                i=i-1
-            if i==0 and self._assdep[0]+1>self._assdep[self._curlin-1]:
-                i=i-1
-            lineno=i+1
-            if lineno<1:
-                blockcont=self._cont(self._curlin-1,0)
-            else:
-                blockcont=self._cont(self._curlin-1,lineno-1)
-            outblockcontext=self._cont(lineno)
-            context=self._cont(self._curlin-1)
+            # The assumption block is the innermost open block, on top of the context stack
+            block=self._stk[-1]
+            lineno=block[3]
+            self._use.extend(block[5])
+            blockcont=dict.fromkeys(block[0][:len(block[0])-self._chg[self._curlin-1][2]])
+            outblockcontext=[]
+            for f in self._stk[:-1]:
+                outblockcontext.extend(f[0])
+            context=outblockcontext+list(blockcont)
+            outblockcontext=dict.fromkeys(outblockcontext)
             asscontext=[] 
-            for j in range(lineno,self._curlin):
-                if self._ass[j]==1 and self._assdep[self._curlin-1]==self._assdep[j]:
-                    asscontext=asscontext+self._statcontext(self._lin[j])
+            for j in block[2]:
+                asscontext=asscontext+self._par[j].context(self._lb,self._rb)
+            self._adddep(self._assdep[self._curlin-1]-1,0)
             # Add reasoning for the line
             self._rea.append('synapsis (L'+str(lineno+1)+'-'+str(self._curlin)+')')
 
@@ -631,15 +1858,14 @@ class prop:
                         conclusion=self._lb+x+self._rb+conclusion
                 if self._scoped==True:
                     newstats=self._resolve([self._lin[lineno],conclusion],context)
-                    self._lin.append(self._lb+newstats[0]+self._im+newstats[1]+self._rb)
+                    self._addlin(self._lb+newstats[0]+self._im+newstats[1]+self._rb)
                 else:
                     allassumptions=''
-                    for k in range(lineno,self._curlin):
-                        if self._ass[k]==1 and self._assdep[self._curlin-2]==self._assdep[k]:
-                            allassumptions=allassumptions+self._lin[k]
-                    self._lin.append(self._lb+allassumptions+self._im+conclusion+self._rb)                
+                    for k in block[2]:
+                        allassumptions=allassumptions+self._lin[k]
+                    self._addlin(self._lb+allassumptions+self._im+conclusion+self._rb)                
             else:
-                self._lin.append(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
+                self._addlin(self._lb+self._lb+self._rb+self._im+self._lb+self._rb+self._rb)
 
         # Return new line index
         return self._curlin
@@ -650,15 +1876,17 @@ class prop:
     #   -linerefs: indicates substitution to be made during implication         #
     #   -ref: position of the formula in the given line                         #
     ############################################################################# 
-    def d(self,lineno=-1,linerefs=[],ref=-1):
+    def d(self,lineno=-1,linerefs=[],ref=-1,auto=False):
         if self._proptype=='Theorem': 
-            self._err.append('Application: '+str([lineno,linerefs,ref]))
-            self.apply(lineno,linerefs,ref)
-            if showing:
-                self.show()
+            n,h=self._curlin,self._err.total()
+            self._echo('d',lineno,linerefs,ref,auto)
+            self.apply(lineno,linerefs,ref,auto)
+            self._record(('d',lineno,linerefs,ref,auto),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
-    def apply(self,lineno=-1,linerefs=[],ref=-1):
+            self._say('Cannot prove an axiom.')
+    def apply(self,lineno=-1,linerefs=[],ref=-1,auto=False):
+        # With auto=True and no linerefs, the concretizations are found by matching the premises with accessible statements
         if lineno==-1:
             lineno=self._curlin
         if ref==-1:
@@ -667,20 +1895,19 @@ class prop:
         # Check if the line is logically accessible (provided line reference is correct)
         if self._curlin==0:
             majorerror=True
-            self._err.append(self._err5+str(self._curlin+1))
+            self._fail(5,self._curlin+1)
         elif self._logdep(lineno-1,self._curlin-1)==False:
             majorerror=True
-            self._err.append(self._err7+str(self._curlin+1))                                   
+            self._fail(7,self._curlin+1)                                   
         # Determine assumption depth of the new line (same as previous line)   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
         # Check if concretizing variables belong to the context
         contextvars=self._cont(self._curlin)
-        self._noncont(self._curlin)
+        if auto and len(linerefs)==0 and majorerror==False:
+            linerefs=self._concretization(lineno,ref,contextvars)
         linerefstats=[]
         for i in range(0,len(linerefs)):
             if type(linerefs[i])==list:
@@ -688,48 +1915,47 @@ class prop:
                     if type(linerefs[i][0])==int and type(linerefs[i][1])==int:
                         if linerefs[i][0] in range(1,len(self._lin)+1):
                             if self._logdep(linerefs[i][0]-1,self._curlin-1):
-                                e=self._extractstat(self._lin[linerefs[i][0]-1])
+                                e=self._par[linerefs[i][0]-1].stats
                                 if linerefs[i][1] in range(1,len(e)+1):
                                     linerefstats.append(e[linerefs[i][1]-1])
                                 else:
-                                    self._err.append(self._err21+str(self._curlin+1))
+                                    self._fail(21,self._curlin+1)
                             else:
-                                self._err.append(self._err7+str(self._curlin+1))
+                                self._fail(7,self._curlin+1)
                         else:
-                            self._err.append(self._err3+str(self._curlin+1))
+                            self._fail(3,self._curlin+1)
                     else:
-                        self._err.append(self._err7+str(self._curlin+1))
+                        self._fail(7,self._curlin+1)
                 elif linerefs[i]==[]:
                     linerefstats.append(self._sp)
                 else: 
-                    self._err.append(self._err7+str(self._curlin+1))
+                    self._fail(7,self._curlin+1)
             elif type(linerefs[i])==int:
                 if linerefs[i] in range(1,len(self._lin)+1):
                     if self._logdep(linerefs[i]-1,self._curlin-1):
-                        e=self._extractstat(self._lin[linerefs[i]-1])
+                        e=self._par[linerefs[i]-1].stats
                         linerefstats.append(e[0])
                     else:
-                        self._err.append(self._err7+str(self._curlin+1))
+                        self._fail(7,self._curlin+1)
                 else:
-                    self._err.append(self._err3+str(self._curlin+1))                
+                    self._fail(3,self._curlin+1)                
             else:
-                self._err.append(self._err3+str(self._curlin+1))
+                self._fail(3,self._curlin+1)
         # Update current line index
         self._curlin=self._curlin+1        
         # Check if line reference is correct and accordingly, add a line to the proof
         if lineno>self._curlin-1 or lineno<1:
-            self._err.append(self._err3+str(self._curlin))
+            self._fail(3,self._curlin)
             majorerror=True
         else:
-            w=self._extractstat(self._lin[lineno-1])
+            w=self._par[lineno-1].kids()
             if ref>len(w):
-                self._err.append(self._err21+str(self._curlin+1))
+                self._fail(21,self._curlin+1)
                 ref=1
-            l=w[ref-1]
-            constants=self._decomposestat(l)[0]
-            statements=self._decomposestat(l)[1]
+            l=w[ref-1].text
+            constants,statements=w[ref-1].decompose()
             if constants!=['',self._im]:
-                self._err.append(self._err11+str(self._curlin))
+                self._fail(11,self._curlin)
                 majorerror=True
             else:
                 #statements=self._resolve(statements,self._statcontext(statements[0])+contextvars)
@@ -743,13 +1969,15 @@ class prop:
                             abstractvarlist.append(v[0])
                 if len(abstractvarlist)>0:
                     if len(linerefstats)>0:
+                        concretization={}
                         for j in range(0,len(abstractvarlist)):
                             if len(linerefstats)<j+1:
                                 k=len(linerefstats)-1
                             else:
                                 k=j
                             if linerefstats[k]!=self._sp:
-                                l=l.replace(self._lb+abstractvarlist[j]+self._rb,linerefstats[k]) 
+                                concretization[abstractvarlist[j]]=linerefstats[k]
+                        l=_subvars(l,concretization,self._lb,self._rb)
                 possib=False
                 pos=[]
                 inferfrom=self._extractargstat(l)
@@ -761,23 +1989,22 @@ class prop:
                         possib=True
                         j=0
                         while j in range(0,len(stats)) and possib==True:
-                            found=False
-                            i=0
-                            while i in range(0,self._curlin) and found==False:
-                                if i<len(self._lin) and j<len(stats):
-                                    if stats[j] in self._extractstat(self._lin[i]) and self._logdep(i,self._curlin-1):
-                                        pos.append(i+1)
-                                        found=True
-                                i=i+1
-                            if found==False:
+                            # The first accessible line stating the premise, if any
+                            found=self._acs.get(stats[j])
+                            if found==None:
+                                found=self._can.get(self._canon(stats[j]))    # stated up to names of bound variables
+                            if found==None:
                                 possib=False
+                            else:
+                                pos.append(found[0]+1)
                             j=j+1        
-                if possib:
-                    r=self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),inferfrom[len(inferfrom)-1])
-                    self._lin.append(r)
-                else:
+                if possib==False:
                     majorerror=True
-                    self._err.append(self._err10+str(self._curlin))
+                    self._fail(10,self._curlin)
+                elif majorerror==False:    # else the line is added void below
+                    self._use.extend([x-1 for x in pos])
+                    r=self._revisestat(self._cont(self._curlin-1),self._noncont(self._curlin-1),inferfrom[len(inferfrom)-1])
+                    self._addlin(r)
         # Add reasoning for the line
         substitution=''
         if len(linerefstats)>0:
@@ -788,12 +2015,105 @@ class prop:
             substitution=' (with concretization '+substitution+')'
         if majorerror:
             self._rea.append('application (void)')
-            self._lin.append(self._lb+self._rb)
+            self._addlin(self._lb+self._rb)
         else:
             self._rea.append('application of L'+str(lineno)+'.'+str(ref)+substitution)
         # Return new line index
         return self._curlin   
 
+    def _concretization(self,lineno,ref,contextvars):
+        # Finds line references concretizing the abstract variables of the implication at line lineno, position ref,
+        # such that all its premises are accessible statements, or returns [] if there are none.
+        for linerefs in self._concretizations(lineno,ref,contextvars):
+            return linerefs
+        return []
+
+    def _concretizations(self,lineno,ref,contextvars):
+        # Generates all line references concretizing the implication at line lineno, position ref, as _concretization
+        # (just [] if it has no abstract variables). Premises are matched in turn against the accessible statements
+        # of the same shape only, those with fewest candidates first.
+        if lineno<1 or lineno>len(self._lin):
+            return
+        w=self._par[lineno-1].kids()
+        if ref<1 or ref>len(w):
+            return
+        constants,statements=w[ref-1].decompose()
+        if constants!=['',self._im]:
+            return
+        assumptions=self._tree(statements[0]).kids()
+        contextvars=dict.fromkeys(contextvars)
+        abstractvarlist=[]
+        for x in assumptions:
+            if len(x.vars(self._lb,self._rb))==1 and x.isvar(self._lb,self._rb) and x.items[0] not in abstractvarlist and x.items[0] not in contextvars:
+                abstractvarlist.append(x.items[0])
+        if len(abstractvarlist)==0:
+            yield []
+            return
+        abstract=dict.fromkeys(abstractvarlist)
+        premises=[]
+        for x in assumptions:
+            if not (x.isvar(self._lb,self._rb) and x.items[0] in abstract):
+                for v in x.vars(self._lb,self._rb):
+                    if v in abstract:
+                        premises.append(x)
+                        break
+        premises.sort(key=lambda x: len(self._shp.get(x.shape(),{})))
+        for binding in self._matches(premises,0,abstract,{}):
+            linerefs=[]
+            for v in abstractvarlist:
+                if v not in binding or binding[v] not in self._acs:
+                    break
+                i=self._acs[binding[v]][0]
+                linerefs.append([i+1,self._par[i].stats.index(binding[v])+1])
+            if len(linerefs)==len(abstractvarlist):
+                yield linerefs
+
+    def _matches(self,premises,j,abstract,binding):    # Generates the bindings matching premises j,j+1,... extending binding
+        if j==len(premises):
+            yield binding
+            return
+        for candidate in list(self._shp.get(premises[j].shape(),{}).values()):
+            extended=dict(binding)
+            if self._unify(premises[j],candidate[0],abstract,extended):
+                for found in self._matches(premises,j+1,abstract,extended):
+                    yield found
+
+    def _nextcont(self):    # The context of a line added at the current assumption depth
+        output=[]
+        for f in self._stk:
+            output.extend(f[0])
+        return output
+
+    def _stated(self,statement):
+        # The [line,position] of an accessible statement stating the given one, up to names of bound variables, or None
+        lines=self._acs.get(statement)
+        if lines!=None:
+            return [lines[0]+1,self._par[lines[0]].stats.index(statement)+1]
+        c=self._canon(statement)
+        lines=self._can.get(c)
+        if lines!=None:
+            return [lines[0]+1,self._canonstats(lines[0]).index(c)+1]
+        return None
+
+    def _unify(self,pattern,t,abstract,binding):    # Matches a statement with abstract variables to a statement
+        if pattern.isvar(self._lb,self._rb) and pattern.items[0] in abstract:
+            v=binding.get(pattern.items[0])
+            if v==None:
+                binding[pattern.items[0]]=t.text
+                return True
+            return v==t.text
+        if len(pattern.items)!=len(t.items):
+            return False
+        for i in range(0,len(pattern.items)):
+            x=pattern.items[i]
+            y=t.items[i]
+            if type(x)==str or type(y)==str:
+                if x!=y:
+                    return False
+            elif not self._unify(x,y,abstract,binding):
+                return False
+        return True
+
     ####### Deduction steps: LSUB and RSUB ##############################################################
     # In these deduction steps, a line of the proof gets substituted into according to an equality.     #
     #   -eqline and eqlinref: coordinates of the statement contains the equation to be applied.                                    #
@@ -802,12 +2122,13 @@ class prop:
     ##################################################################################################### 
     def ls(self,eqline=-1,lineno=-1,instance=[],eqlinref=-1,linref=-1):
         if self._proptype=='Theorem': 
-            self._err.append('Left substitution: '+str([eqline,lineno,instance,eqlinref,linref]))
+            n,h=self._curlin,self._err.total()
+            self._echo('ls',eqline,lineno,instance,eqlinref,linref)
             self.lsub(eqline,lineno,instance,eqlinref,linref)
-            if showing:
-                self.show()
+            self._record(('ls',eqline,lineno,instance,eqlinref,linref),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def lsub(self,eqline=-1,lineno=-1,instance=[],eqlinref=-1,linref=-1):
         if eqline==-1:
             eqline=self._curlin
@@ -823,36 +2144,36 @@ class prop:
         eqRHS=''
 
         if eqline>0 and eqline<len(self._lin)+1:
-            s=self._extractstat(self._lin[eqline-1])
+            s=self._par[eqline-1].kids()
             if eqlinref<len(s)+1 and 0<eqlinref:
-                D=self._decomposestat(s[eqlinref-1])
+                D=s[eqlinref-1].decompose()
             else:
                 D=[[]]
             if D[0]!=['',self._eq]:
                 noequality=True
-                self._err.append(self._err17+str(self._curlin+1))
+                self._fail(17,self._curlin+1)
             elif len(D[1])!=2:
                 noequality=True
-                self._err.append(self._err17+str(self._curlin+1))
+                self._fail(17,self._curlin+1)
             else:
                 eqLHS=D[1][0]
                 eqRHS=D[1][1]
 
         else:
             noequality=True
-            self._err.append(self._err17+str(self._curlin+1))
+            self._fail(17,self._curlin+1)
         if self._logdep(eqline-1,self._curlin-1)==False:
             noequality=True
-            self._err.append(self._err7+str(self._curlin+1))
+            self._fail(7,self._curlin+1)
         
         if self._curlin==0:
             noequality=True
-            self._err.append(self._err5+str(self._curlin+1))
+            self._fail(5,self._curlin+1)
         if lineno<1 or lineno>len(self._lin):
             noequality=True
-            self._err.append(self._err3+str(self._curlin+1))
+            self._fail(3,self._curlin+1)
         else:
-            t=self._extractstat(self._lin[lineno-1])
+            t=self._par[lineno-1].stats
             if linref<len(t)+1 and 0<linref and noequality==False:
                 line=t[linref-1]
             else:
@@ -860,19 +2181,17 @@ class prop:
             if eqline<1 or eqline>len(self._lin):
                 noequality=True
                 line=self._lb+self._rb
-                self._err.append(self._err3+str(self._curlin+1))
+                self._fail(3,self._curlin+1)
         if self._logdep(lineno-1,self._curlin-1)==False:
             noequality=True
             line=self._lb+self._rb
-            self._err.append(self._err7+str(self._curlin+1))
+            self._fail(7,self._curlin+1)
 
         # Determine assumption depth of the new line (same as previous line)   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
 
         if noequality==False:
             res=self._resolve([eqLHS,eqRHS,line],self._cont(self._curlin))
@@ -880,17 +2199,11 @@ class prop:
             eqRHS=res[1]
             line=res[2]
             self._rea.append('left substitution, L'+str(eqline)+'('+str(eqlinref)+') in L'+str(lineno)+'('+str(linref)+')') 
-            if len(instance)>0:
-                k=0
-                for n in range(0,len(instance)):
-                    line=self._nth_repl(line,eqRHS,eqLHS,instance[n+k])
-                    k=k-1
-            else:
-                line=line.replace(eqRHS,eqLHS)
+            line=self._substitute(line,eqRHS,eqLHS,instance)
         else:
             self._rea.append('left substitution (void)')
         
-        self._lin.append(line)                
+        self._addlin(line)                
 
         # Update current line index
         self._curlin=self._curlin+1
@@ -898,12 +2211,13 @@ class prop:
         return self._curlin
     def rs(self,eqline=-1,lineno=-1,instance=[],eqlinref=-1,linref=-1):
         if self._proptype=='Theorem': 
-            self._err.append('Right substitution: '+str([eqline,lineno,instance,eqlinref,linref]))
+            n,h=self._curlin,self._err.total()
+            self._echo('rs',eqline,lineno,instance,eqlinref,linref)
             self.rsub(eqline,lineno,instance,eqlinref,linref)
-            if showing:
-                self.show()
+            self._record(('rs',eqline,lineno,instance,eqlinref,linref),n,h)
+            self._update()
         else:
-            print('Cannot prove an axiom.')
+            self._say('Cannot prove an axiom.')
     def rsub(self,eqline=-1,lineno=-1,instance=[],eqlinref=-1,linref=-1):
         if eqline==-1:
             eqline=self._curlin
@@ -920,35 +2234,35 @@ class prop:
         # Add reasoning for the line
 
         if eqline>0 and eqline<len(self._lin)+1:
-            s=self._extractstat(self._lin[eqline-1])
+            s=self._par[eqline-1].kids()
             if eqlinref<len(s)+1 and 0<eqlinref:
-                D=self._decomposestat(s[eqlinref-1])
+                D=s[eqlinref-1].decompose()
             else:
                 D=[[]]
             if D[0]!=['',self._eq]:
                 noequality=True
-                self._err.append(self._err17+str(self._curlin+1))
+                self._fail(17,self._curlin+1)
             elif len(D[1])!=2:
                 noequality=True
-                self._err.append(self._err17+str(self._curlin+1))
+                self._fail(17,self._curlin+1)
             else:
                 eqLHS=D[1][1]
                 eqRHS=D[1][0]
         else:
             noequality=True
-            self._err.append(self._err17+str(self._curlin+1))
+            self._fail(17,self._curlin+1)
         if self._logdep(eqline-1,self._curlin-1)==False:
             noequality=True
-            self._err.append(self._err7+str(self._curlin+1))
+            self._fail(7,self._curlin+1)
         
         if self._curlin==0:
             noequality=True
-            self._err.append(self._err5+str(self._curlin+1))
+            self._fail(5,self._curlin+1)
         if lineno<1 or lineno>len(self._lin):
             noequality=True
-            self._err.append(self._err3+str(self._curlin+1))
+            self._fail(3,self._curlin+1)
         else:
-            t=self._extractstat(self._lin[lineno-1])
+            t=self._par[lineno-1].stats
             if linref<len(t)+1 and 0<linref and noequality==False:
                 line=t[linref-1]
             else:
@@ -956,19 +2270,17 @@ class prop:
             if eqline<1 or eqline>len(self._lin):
                 noequality=True
                 line=self._lb+self._rb
-                self._err.append(self._err3+str(self._curlin+1))
+                self._fail(3,self._curlin+1)
         if self._logdep(lineno-1,self._curlin-1)==False:
             noequality=True
             line=self._lb+self._rb
-            self._err.append(self._err7+str(self._curlin+1))
+            self._fail(7,self._curlin+1)
 
         # Determine assumption depth of the new line (same as previous line)   
         if self._curlin==0:
-            self._assdep.append(0)
-            self._ass.append(0)
+            self._adddep(0,0)
         else:
-            self._assdep.append(self._assdep[self._curlin-1])
-            self._ass.append(0)
+            self._adddep(self._assdep[self._curlin-1],0)
             
         if noequality==False:
             res=self._resolve([eqLHS,eqRHS,line],self._cont(self._curlin))
@@ -976,17 +2288,11 @@ class prop:
             eqRHS=res[1]
             line=res[2]
             self._rea.append('right substitution, L'+str(eqline)+'('+str(eqlinref)+') in L'+str(lineno)+'('+str(linref)+')') 
-            if len(instance)>0:
-                k=0
-                for n in range(0,len(instance)):
-                    line=self._nth_repl(line,eqRHS,eqLHS,instance[n+k])
-                    k=k-1
-            else:
-                line=line.replace(eqRHS,eqLHS)
+            line=self._substitute(line,eqRHS,eqLHS,instance)
         else:
             self._rea.append('right substitution (void)') 
         
-        self._lin.append(line)
+        self._addlin(line)
         # Update current line index
         self._curlin=self._curlin+1
         # Return new line index
@@ -996,120 +2302,103 @@ class prop:
     # This indicates completion of the proof. The proof is then displayed along with the list of errors   #
     ####################################################################################################### 
     def QED(self,showornot=True):
-        p=[]
+        p=self.render()
+        if showornot:
+            for x in p:
+                self._say(x)
+        if self._proptype=='Theorem':
+            if self._curlin<1:
+                return False
+            return p
+
+    def render(self):    # Returns the displayed proposition, with its proof for theorems, as a list of lines
+        p=['']
         if self._proptype=='Proposition':
-            print('')
-            print('Proposition: '+self._nam+'.')
-            print(self._lb+self._rb)
+            p.append('Proposition: '+self._nam+'.')
+            p.append(self._lb+self._rb)
         elif self._proptype=='Axiom':
-            if showornot:
-                print('')
-            p.append('')
-            if showornot:
-                print('Axiom: '+self._nam+'.')
             p.append('Axiom: '+self._nam+'.')
-            if showornot:
-                print(self._propsta)
             p.append(self._propsta)
         elif self._proptype=='Theorem':
-            if showornot:
-                print('')
-            p.append('')
-            if showornot:
-                print('Theorem: '+self._nam+'.')
             p.append('Theorem: '+self._nam+'.')
             if self._curlin<1:
-                if showornot:
-                    print('Empty theorem.')
                 p.append('Empty theorem.')
-                return False
             else:
-                if self._assdep[self._curlin-1]==0:
-                    context=self._cont(self._curlin-1)
-                    conclusion=self._lin[self._curlin-1]
-                    if self._curlin>1:
-                        conclusionvars=self._vars(conclusion)
-                        conclusioncontext=self._statcontext(conclusion)
-                        addedvars=[]
-                        for x in conclusionvars:
-                            if x in context and x not in conclusioncontext and x not in addedvars:
-                                addedvars.append(x)
-                                conclusion=self._lb+x+self._rb+conclusion
-                    self._propsta=conclusion
-                    if showornot:
-                        print(self._propsta) 
-                    p.append(self._propsta)     
-                else:
-                    self._propsta=self._lb+self._rb
-                    if showornot:
-                        print(self._propsta)
-                    p.append(self._propsta)
-                if showornot:
-                    print(self._prfnam+'.')
+                p.append(self._conclude())
                 p.append(self._prfnam+'.')
                 for i in range(0,len(self._lin)):
-                    prefix=''
-                    if i==0:
-                        if self._assdep[i]==0:
-                            prefix=''
-                        else:
-                            if len(self._assdep)>1:
-                                if self._assdep[1]==0:
-                                    prefix=self._sal
-                                else:
-                                    prefix=self._al
-                            else:
-                                prefix=self._al
-                    elif i==len(self._lin)-1:
-                        if self._assdep[i]==0:
-                            prefix=''
-                        elif self._assdep[i-1]<self._assdep[i]:
-                            prefix=self._al
-                        elif self._assdep[i-1]==self._assdep[i]:
-                            if self._ass[i]==0:
-                                prefix=self._il
-                            else:
-                                prefix=self._ma
-                        else:
-                            prefix=self._cl
-                    else:        
-                        if self._assdep[i]==0:
-                            prefix=''
-                        elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]>self._assdep[i]-1:
-                            prefix=self._al
-                        elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]<self._assdep[i]:
-                            prefix=self._sal
-                        elif self._assdep[i-1]==self._assdep[i] and self._assdep[i+1]==self._assdep[i]:
-                            if self._ass[i]==0:
-                                prefix=self._il
-                            else:
-                                prefix=self._ma
-                        elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]<self._assdep[i]:
-                            prefix=self._cl
-                        elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]>self._assdep[i]-1:
-                            if self._ass[i]==0:
-                                prefix=self._il
-                            else:
-                                prefix=self._ma
-                    for j in range(0,self._assdep[i]-1):
-                        prefix=self._il+prefix
-                    context='none'
-                    if self._scoped==True:                
-                        c=self._cont(i)
-                    else:
-                        c=self._noncont(i)
-                    if len(c)>0:
-                        context=c[0] 
-                    for j in range(1,len(c)):
-                        context=context+','+c[j]
-                    line=self._displaystat(self._lin[i]) 
-                    if showornot:
-                        print(' '+prefix+''+line+' /L'+str(i+1)+': '+self._rea[i]+'.')
-                    p.append(' '+prefix+''+line+' /L'+str(i+1)+': '+self._rea[i]+'.')
-                if showornot:
-                    print(self._ep)
+                    p.append(self._line(i,len(self._lin)))
                 p.append(self._ep)
-                return p
+        return p
+
+    def _prefix(self,i,n):    # Returns the box characters displayed before line i of the first n lines of the proof
+        prefix=''
+        if i==0:
+            if self._assdep[i]==0:
+                prefix=''
+            else:
+                if n>1:
+                    if self._assdep[1]==0:
+                        prefix=self._sal
+                    else:
+                        prefix=self._al
+                else:
+                    prefix=self._al
+        elif i==n-1:
+            if self._assdep[i]==0:
+                prefix=''
+            elif self._assdep[i-1]<self._assdep[i]:
+                prefix=self._al
+            elif self._assdep[i-1]==self._assdep[i]:
+                if self._ass[i]==0:
+                    prefix=self._il
+                else:
+                    prefix=self._ma
+            else:
+                prefix=self._cl
+        else:        
+            if self._assdep[i]==0:
+                prefix=''
+            elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]>self._assdep[i]-1:
+                prefix=self._al
+            elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]<self._assdep[i]:
+                prefix=self._sal
+            elif self._assdep[i-1]==self._assdep[i] and self._assdep[i+1]==self._assdep[i]:
+                if self._ass[i]==0:
+                    prefix=self._il
+                else:
+                    prefix=self._ma
+            elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]<self._assdep[i]:
+                prefix=self._cl
+            elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]>self._assdep[i]-1:
+                if self._ass[i]==0:
+                    prefix=self._il
+                else:
+                    prefix=self._ma
+        for j in range(0,self._assdep[i]-1):
+            prefix=self._il+prefix
+        return prefix
+
+    def _line(self,i,n):    # Returns line i as displayed in the first n lines of the proof
+        return ' '+self._prefix(i,n)+self._displaystat(self._lin[i])+' /L'+str(i+1)+': '+self._rea[i]+'.'
+
+    def _conclude(self):    # Returns the statement proved, recomputing it only after the proof has changed
+        if not self._concluded:
+            self._propsta=self._lb+self._rb
+            if self._curlin>0 and self._assdep[self._curlin-1]==0:
+                context=self._cont(self._curlin-1)
+                conclusion=self._lin[self._curlin-1]
+                if self._curlin>1:
+                    conclusionvars=self._vars(conclusion)
+                    conclusioncontext=self._statcontext(conclusion)
+                    addedvars=[]
+                    for x in conclusionvars:
+                        if x in context and x not in conclusioncontext and x not in addedvars:
+                            addedvars.append(x)
+                            conclusion=self._lb+x+self._rb+conclusion
+                self._propsta=conclusion
+            self._concluded=True
+        return self._propsta
 
     def subin(self,form,variables,context):
         formvars=self._vars(form)
@@ -1118,75 +2407,67 @@ class prop:
         for x in formvars:
             if x not in context:
                 subformvars.append(x)
-        for i in range(0,min(len(subformvars),len(variables))):
-            output=output.replace(self._lb+subformvars[i]+self._rb,self._lb+variables[i]+self._rb)
-        return self._lb+output+self._rb
+        return self._lb+self._rename(output,subformvars,variables)+self._rb
+
+    def _rename(self,statement,oldvars,newvars):
+        # Renames each variable in oldvars to the variable at the same position in newvars, all in one pass.
+        # Extra variables in either list are ignored, and a variable listed twice keeps its first new name.
+        renamed={}
+        for i in range(0,min(len(oldvars),len(newvars))):
+            if oldvars[i] not in renamed:
+                renamed[oldvars[i]]=self._lb+newvars[i]+self._rb
+        return _subvars(statement,renamed,self._lb,self._rb)
 
     def _revisestat(self,contextvars,reservedvars,statement):
         statcontextvars=self._statcontext(statement)
-        statreservedvars=self._vars(statement)
         output=statement
+        reserved=dict.fromkeys(reservedvars)
+        contextvars=dict.fromkeys(contextvars)
+        names=None
+        renamed={}
         for x in statcontextvars:
-            if x in reservedvars and x not in contextvars:
-                output=output.replace(self._lb+x+self._rb, self._lb+self._renamevar(x,reservedvars+statreservedvars)+self._rb)
-        return output
+            if x in reserved and x not in contextvars:
+                if names==None:
+                    taken=dict(reserved)
+                    taken.update(dict.fromkeys(self._vars(statement)))
+                    names=_names(taken,self._pr,self._pm,self._ss)
+                renamed[x]=self._lb+names.fresh(x)+self._rb
+        return _subvars(output,renamed,self._lb,self._rb)
+
+    def occurrences(self,stat,lineno=-1,linref=-1):
+        # Returns the occurrences of stat in the statement at line lineno, position linref, as (number, offset, depth).
+        # The numbers (or the triples themselves) can be passed as instances to ls and rs.
+        if lineno==-1:
+            lineno=self._curlin
+        if linref==-1:
+            linref=1
+        if lineno<1 or lineno>len(self._lin):
+            return []
+        t=self._par[lineno-1].kids()
+        if linref<1 or linref>len(t):
+            return []
+        parts=self._tree(stat).stats
+        if len(parts)==0 or ''.join(parts)!=stat:
+            return []
+        return self._tree(t[linref-1].text).occurrences(parts)
+
+    def _substitute(self,line,old,new,instance=[]):
+        # Replaces the occurrences of the statements old in line by new, in a single pass over the parsed line:
+        # the occurrences numbered in instance (counted in the original line), or all of them if instance is empty.
+        # Instances may also be given as returned by occurrences.
+        chosen=None
+        if len(instance)>0:
+            chosen={}
+            for n in instance:
+                if type(n)==tuple or type(n)==list:
+                    n=n[0]
+                if n==-1:
+                    n=1
+                chosen[n]=None
+        return self._tree(line).substitute(self._tree(old).stats,new,chosen,self._rb)[0]
 
-    def _nth_repl(self,s, sub, repl, n=-1):
-        if n==-1:
-            n=1
-        find = s.find(sub)
-        if find>-1:
-            i=1
-            while find != -1 and i != n:
-                find = s.find(sub, find + 1)
-                i = i+1
-        
-            if i == n and find != -1:
-                return s[:find] + repl + s[find+len(sub):]
-        return s            
-
-    def _cleanupline(self,line,lineno):
-        stats=self._extractstat(line)
-        removedstats=[]
-        for i in range(0,lineno-1):
-            if self._logdep(i,lineno-1):
-                compareto=self._extractstat(self._lin[i])
-                for x in stats:
-                    if x in compareto:
-                        removedstats.append(x)
-        output=''
-        for x in stats:
-            if x not in removedstats:
-                output=output+x
-        if output=='':
-            output=self._lb+self._rb
-        return output
-    # Returns whether the stated formula can be found in an expression with possibly different variable inputs     
-    def _instance(self,statform,expression):
-        if self._isvar(statform):
-            if expression.find(statform)>-1:
-                return True
-            else:
-                return False           
-        else:
-            f=self._extractformula(statform)
-            e=expression
-            fvars=self._vars(f)
-            evars=self._vars(e)
-            for i in range(0,len(fvars)):
-                f=f.replace(self._lb+fvars[i]+self._rb,self._lb+self._sb+self._rb)
-            for i in range(0,len(evars)):
-                e=e.replace(self._lb+evars[i]+self._rb,self._lb+self._sb+self._rb)
-            if e.find(self._lb+f+self._rb)>-1:
-                return True
-            else:
-                return False
-        
     def _extractformula(self,statement):      # Returns the formula in a single statement
-        output=''
-        for i in range(1,len(statement)-1):
-            output=output+statement[i]
-        return output
+        return statement[1:len(statement)-1]
 
     def _singlestat(self,statement):     # Returns input if single statement and empty statement otherwise
         output=self._lb+self._rb
@@ -1198,33 +2479,144 @@ class prop:
         return output  
 
     def _statcontext(self,statement):    # Returns list of outer variables in a statement
-        output=[]
-        e=self._extractstat(statement)
-        for x in e:
-            if self._isvar(x):
-                output.append(self._extractformula(x))
-        return output
+        return self._tree(statement).context(self._lb,self._rb)
 
     def _extractstat(self,statement):    # Extracts outer level statements from an expression
-        output=[]
-        i=0
-        while i in range(0,len(statement)):
-            if statement[i]==self._lb:
-                s=self._lb
-                d=1
-                j=i+1
-                while j in range(i+1,len(statement)) and d>0:
-                    if statement[j]==self._lb:
-                        d=d+1
-                    elif statement[j]==self._rb:
-                        d=d-1
-                    s=s+statement[j]
-                    j=j+1
-                output.append(s)
-                i=j
+        return list(self._tree(statement).stats)
+
+    def _tree(self,statement):           # Returns the parsed expression, parsing it only the first time it is seen
+        t=self._pc.get(statement)
+        if t==None:
+            t=_parse(statement,self._lb,self._rb)
+            if len(self._pc)>=self._pcm:
+                self._pc.popitem(False)    # the least recently used
+            self._pc[statement]=t
+        else:
+            self._pc.move_to_end(statement)
+        return t
+
+    def _single(self,statement):         # Returns the tree of a single statement, or None if the input is not one
+        t=self._tree(statement)
+        if len(t.items)==1 and type(t.items[0])==tree and t.items[0].text==statement:
+            return t.items[0]
+        return None
+
+    def _addlin(self,line):              # Adds a line to the proof, together with its parsed tree
+        self._concluded=False
+        self._lin.append(line)
+        self._stp.append(None)
+        t=self._tree(line)
+        self._par.append(t)
+        # Add the variables of the line to the innermost frame of the context stack
+        i=len(self._lin)-1
+        f=self._stk[-1]
+        c=self._chg[i]
+        for v in t.context(self._lb,self._rb):
+            if v not in self._cvd:
+                self._cvd[v]=None
+                f[0].append(v)
+                c[2]=c[2]+1
+        for v in t.vars(self._lb,self._rb):
+            if v not in self._nvd:
+                self._nvd[v]=None
+                f[1].append(v)
+                c[3]=c[3]+1
+        if self._ass[i]==1:
+            f[2].append(i)
+        f[5].append(i)
+        self._index(i)
+
+    def _index(self,i):                  # Adds the outer level statements of a line to the indexes
+        # Entries are tuples, replaced rather than changed, so that forks can share them
+        for x in self._par[i].stats:
+            self._acs[x]=self._acs.get(x,())+(i,)
+        for x in self._canonstats(i):
+            self._can[x]=self._can.get(x,())+(i,)
+        for x in self._par[i].kids():
+            stats=self._shp.setdefault(x.shape(),{})
+            stats[x.text]=(x,stats.get(x.text,(x,0))[1]+1)
+
+    def _unindex(self,i):                # Removes the outer level statements of the last indexed line
+        for x in reversed(self._par[i].stats):
+            lines=self._acs[x]
+            if len(lines)==1:
+                del self._acs[x]
             else:
-                i=i+1
-        return output
+                self._acs[x]=lines[:-1]
+        for x in reversed(self._canonstats(i)):
+            lines=self._can[x]
+            if len(lines)==1:
+                del self._can[x]
+            else:
+                self._can[x]=lines[:-1]
+        for x in self._par[i].kids():
+            stats=self._shp[x.shape()]
+            if stats[x.text][1]==1:
+                del stats[x.text]
+                if len(stats)==0:
+                    del self._shp[x.shape()]
+            else:
+                stats[x.text]=(x,stats[x.text][1]-1)
+
+    def _canonstats(self,i):             # Canonical forms of the outer level statements of a line
+        return self._par[i].canonicalstats(self._sp,self._im,self._lb,self._rb)
+
+    def _canon(self,statement,top=False):    # Canonical form of an expression, see tree.canonical
+        return self._tree(statement).canonical(self._sp,self._im,self._lb,self._rb,top)
+
+    def _adddep(self,depth,ass):         # Sets the assumption depth of a new line, opening or closing blocks
+        self._assdep.append(depth)
+        self._ass.append(ass)
+        i=len(self._assdep)-1
+        popped=[]
+        while len(self._stk)>depth+1:
+            f=self._stk.pop()
+            for v in f[0]:
+                del self._cvd[v]
+            for v in f[1]:
+                del self._nvd[v]
+            for j in reversed(f[5]):
+                self._unindex(j)
+            self._bcl[f[4]]=i
+            popped.append(f)
+        pushed=0
+        while len(self._stk)<depth+1:
+            self._bpa.append(self._stk[-1][4])
+            self._stk.append([_plist(),_plist(),_plist(),i,len(self._bop),_plist()])
+            self._bop.append(i)
+            self._bcl.append(None)
+            pushed=pushed+1
+        self._blk.append(self._stk[-1][4])
+        self._chg.append([pushed,popped,0,0])
+
+    def _unstack(self):                  # Rolls the context stack back to before the last line
+        i=len(self._lin)-1
+        c=self._chg.pop()
+        f=self._stk[-1]
+        for k in range(0,c[2]):
+            del self._cvd[f[0].pop()]
+        for k in range(0,c[3]):
+            del self._nvd[f[1].pop()]
+        if len(f[2])>0 and f[2][-1]==i:
+            f[2].pop()
+        f[5].pop()
+        self._unindex(i)
+        self._blk.pop()
+        for k in range(0,c[0]):
+            self._stk.pop()
+            self._bop.pop()
+            self._bcl.pop()
+            self._bpa.pop()
+        for f in reversed(c[1]):
+            f=[f[0].copy(),f[1].copy(),f[2].copy(),f[3],f[4],f[5].copy()]    # the popped frame may be shared by forks
+            self._stk.append(f)
+            self._bcl[f[4]]=None
+            for j in f[5]:
+                self._index(j)
+            for v in f[0]:
+                self._cvd[v]=None
+            for v in f[1]:
+                self._nvd[v]=None
     
     def _displaystat(self,statement):
         #s=self._extractstat(statement)
@@ -1257,6 +2649,9 @@ class prop:
         #return output 
 
     def _extractargstat(self,statement):     # Extracts outer level statements from a stated argument
+        t=self._single(statement)
+        if t!=None:
+            return t.argstats(self._im)
         output=[]
         stat=''
         i=1
@@ -1285,6 +2680,9 @@ class prop:
         return output
 
     def _decomposestat(self,statement):  # Decompose a stated formula into an array of constants and statements
+        t=self._single(statement)
+        if t!=None:
+            return t.decompose()
         states=[]
         constants=[]
         stat=''
@@ -1324,49 +2722,54 @@ class prop:
     
     def _resolve(self,statements,context):   # Eliminates variable conflict in an array of statements, based on a context
         output=[statements[0]]
+        context=dict.fromkeys(context)
+        premisevars=dict.fromkeys(self._vars(statements[0]))
         for i in range(1,len(statements)):
             conclusion=statements[i]
             conclusionvars=self._vars(conclusion)
-            premisevars=[]
-            for j in range(0,len(output)):
-                premisevars=premisevars+self._vars(output[j])
+            names=None
+            renamed={}
             for x in conclusionvars:
                 if x in premisevars and x not in context:
-                    renamex=self._renamevar(x,context+conclusionvars+premisevars)
-                    conclusion=conclusion.replace(self._lb+x+self._rb,self._lb+renamex+self._rb)
+                    if names==None:
+                        taken=dict(context)
+                        taken.update(dict.fromkeys(conclusionvars))
+                        taken.update(premisevars)
+                        names=_names(taken,self._pr,self._pm,self._ss)
+                    renamed[x]=self._lb+names.fresh(x)+self._rb
+            conclusion=_subvars(conclusion,renamed,self._lb,self._rb)
             output.append(conclusion)
-        #print(output)
+            premisevars.update(dict.fromkeys(self._vars(conclusion)))
         return output
     
     def _renamevar(self,varname,notvars):    # Renames a variable name that does not appear in the list
-        newname=varname
-        primecount=0
-        for i in range(0,len(varname)):
-            if varname[i]==self._pr:
-                primecount=primecount+1
-        i=0
-        while newname in notvars:
-            if primecount<self._pm and varname[len(varname)-1]!=self._pr:
-                newname=newname+self._pr
-                primecount=primecount+1
-            else:
-                newname=newname+self._pr
-                newname=varname+self._ss+str(i)
-                i=i+1
-        return newname
+        if type(notvars)!=dict:
+            notvars=dict.fromkeys(notvars)
+        return _names(notvars,self._pr,self._pm,self._ss).fresh(varname)
     
     def _cont(self,linenumber,fromline=1):  # Returns the variable context of a line in the proof
+        if fromline==1 and self._stacked(linenumber):
+            output=[]
+            for f in self._stk:
+                output.extend(f[0])
+            if linenumber<len(self._lin):
+                del output[len(output)-self._chg[linenumber][2]:]
+            return output
         output=[]
         for i in range(fromline-1,linenumber):
-            if len(self._vars(self._lin[i]))>0:
+            if len(self._par[i].vars(self._lb,self._rb))>0:
                 if self._logdep(i,linenumber)==True:
-                    s=self._extractstat(self._lin[i])
-                    for v in s:
-                        w=self._extractformula(v)
-                        if self._isvar(v) and (w not in output):
+                    for w in self._par[i].context(self._lb,self._rb):
+                        if w not in output:
                             output.append(w)
         return output
 
+    def _stacked(self,linenumber):   # Checks whether the context stack holds the context of the given line
+        # This is so for a line being added, and for the last line (excluding its own variables)
+        if len(self._assdep)==linenumber+1:
+            return linenumber==len(self._lin) or linenumber==len(self._lin)-1
+        return False
+
     def _statfromformulas(self, formulas):
         output=''
         for i in range(0,len(formulas)):
@@ -1376,10 +2779,19 @@ class prop:
         return output
 
     def _noncont(self,linenumber):   # Returns all variables that logically influence a given line in a non-scoped proof
+        if self._stacked(linenumber):
+            output=dict(self._nvd)
+            if linenumber<len(self._lin):
+                f=self._stk[-1][1]
+                for v in f[len(f)-self._chg[linenumber][3]:]:
+                    del output[v]
+            output=list(output)
+            output.sort()
+            return output
         output=[]
         for i in range(0,linenumber):
             if self._logdep(i,linenumber)==True:
-                output=output+self._vars(self._lin[i])
+                output=output+list(self._par[i].vars(self._lb,self._rb))
         if len(output)>0:
             output=list(dict.fromkeys(output))
             output.sort()
@@ -1399,29 +2811,13 @@ class prop:
         return True 
     
     def _vars(self,exp):     # Returns the list of all variables in a given expression
-        output=[]
-        for i in range(0,len(exp)):
-            if exp[i]==self._lb:
-                j=i+1
-                variable=''
-                isvariable=True
-                while exp[j]!=self._rb and isvariable==True and j<len(exp):
-                    if exp[j]==self._lb:
-                        isvariable=False
-                    variable=variable+exp[j]
-                    j=j+1
-                if isvariable==True and variable!='':
-                    output.append(variable)
-        return output                                          
+        return list(self._tree(exp).vars(self._lb,self._rb))
     
     def _logdep(self,line1,line2):   # Check if lines are in logical dependence
-        if line2>-1 and line1>-1 and line1<line2+1:
-            i=line1
-            while i<line2 and self._assdep[i]>self._assdep[line1]-1:
-                i=i+1
-            if self._assdep[i]<self._assdep[line1]:
-                return False
-            return True
+        # The first line is accessible from the second when its block is still open there
+        if line2>-1 and line1>-1 and line1<line2+1 and line1<len(self._blk):
+            c=self._bcl[self._blk[line1]]
+            return c==None or c>line2
         else:
             return False                        
 
@@ -1454,73 +2850,521 @@ class prop:
             return False
         return True
     def _printline(self,printlineno):
-        for i in range(printlineno,printlineno+1):
-            prefix=''
-            if i==0:
-                if self._assdep[i]==0:
-                    prefix=''
-                else:
-                    if len(self._assdep)>1:
-                        if self._assdep[1]==0:
-                            prefix=self._sal
-                        else:
-                            prefix=self._al
-                    else:
-                        prefix=self._al
-            elif i==len(self._lin)-1:
-                if self._assdep[i]!=1:
-                    if self._assdep[i]==0:
-                        prefix=''
-                    elif self._assdep[i-1]<self._assdep[i]:
-                        prefix=self._al
-                    elif self._assdep[i-1]==self._assdep[i]:
-                        if self._ass[i]==0:
-                            prefix=self._il
-                        else:
-                            prefix=self._ma
-                    else:
-                        if self._ass[i]==0:
-                            prefix=self._il
-                        else:
-                            prefix=self._ma
-                else:
-                    prefix=self._il
-            else:        
-                if self._assdep[i]==0:
-                    prefix=''
-                elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]>self._assdep[i]-1:
-                    prefix=self._al
-                elif self._assdep[i-1]<self._assdep[i] and self._assdep[i+1]<self._assdep[i]:
-                    prefix=self._sal
-                elif self._assdep[i-1]==self._assdep[i] and self._assdep[i+1]==self._assdep[i]:
-                    if self._ass[i]==0:
-                        prefix=self._il
-                    else:
-                        prefix=self._ma
-                elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]<self._assdep[i]:
-                    if self._ass[i]==0:
-                        prefix=self._il
-                    else:
-                        prefix=self._ma
-                elif self._assdep[i-1]>self._assdep[i]-1 and self._assdep[i+1]>self._assdep[i]-1:
-                    if self._ass[i]==0:
-                        prefix=self._il
+        self._say(self._line(printlineno,len(self._lin)))
+
+########################################################################################### 
+# THEORIES (theory class)                                                                 #
+# An object of this class collects axioms and theorems, each theorem given by the script  #
+# of its proof: a list of steps (method, arguments...), e.g. ('a','[x]') or ('d',2,[[1,1]]).#
+# A recall step ('c',name) refers to another proposition of the theory by its name; it    #
+# may also recall a prop object directly, e.g. one returned by an axiom builder.          #
+# Checking the theory verifies the theorems in the order of their recalls, verifying      #
+# theorems that do not depend on each other in parallel.                                  #
+###########################################################################################
+def _checkscript(name,script,recalled):
+    # Verifies the proof script of a theorem, where recalled maps the names it recalls to their statements.
+    # Returns the theorem as dumped by prop.dump.
+    P=prop(name,['silent'])
+    P.t(name)
+    for step in script:
+        args=list(step[1:])
+        if step[0]=='c' and len(args)>0 and type(args[0])==str and args[0] in recalled:
+            A=prop(args[0],['silent'])
+            A.postulate(recalled[args[0]])
+            args[0]=A
+        getattr(P,step[0])(*args)
+    return P.dump()
+
+def _checkpart(data,steps):
+    # Makes again the lines of a part of a proof by their steps, after the lines before it as dumped by prop.dump.
+    # Recalled propositions are given as dictionaries with their name and statement. Returns the lines made, each
+    # with its reason, depth, assumption flag and whether it triggered an error, and the history of the steps.
+    # Only proof steps (see _editable) are made, the lines of the steps from the first other one on are missing.
+    P=prop(data['name'],['silent']).load(data)
+    start=P._curlin
+    for step in steps:
+        if len(step)==0 or step[0] not in _editable:
+            break
+        step=_unlogged(step)
+        getattr(P,step[0])(*step[1:])
+    lines=[[P._lin[i],P._rea[i],P._assdep[i],P._ass[i],P._stp[i][2]] for i in range(start,P._curlin)]
+    return lines,P.showh(True)
+
+_cachever='SOFiA 20 Dec 2023 / 1'    # Changing this invalidates all cached theorems
+
+def _readcache(cache):    # The theorems stored in a cache file of theory.check, by key (none if it is missing or unreadable)
+    try:
+        with open(cache,encoding='utf-8') as f:
+            stored=json.load(f)
+    except (OSError,ValueError):
+        return {}
+    if type(stored)!=dict:
+        return {}
+    return stored
+
+class theory:
+    def __init__(self,name='Theory'):
+        self._nam=name
+        self._pro={}     # Statements of the axioms and of the theorems verified, by name
+        self._scr={}     # Proof scripts of the theorems, by name
+        self._dep={}     # Names of the propositions of the theory recalled by each theorem
+        self._rep={}     # Errors triggered in each theorem when last checked
+        self._res={}     # Theorems verified, as dumped by prop.dump, by name
+        self._fnd=None   # Names of the propositions by the canonical form of their statements (built by find)
+
+    def ax(self,name,statement=''):
+        # Adds an axiom stating the given statement
+        P=prop(name,['silent'])
+        self._pro[name]=P.postulate(statement)
+        self._fnd=None
+        return self
+
+    def add(self,pro):
+        # Adds an existing axiom or theorem (a prop object) to the theory, by its name
+        self._pro[pro._nam]=pro.getstatement()
+        self._fnd=None
+        return self
+
+    def t(self,name,script=[]):
+        # Adds a theorem with the given proof script
+        self._scr[name]=[tuple(step) for step in script]
+        self._dep[name]=[]
+        for step in self._scr[name]:
+            if step[0]=='c' and len(step)>1 and type(step[1])==str and step[1] not in self._dep[name]:
+                self._dep[name].append(step[1])
+        self._pro.pop(name,None)
+        self._fnd=None
+        return self
+
+    def getstatement(self,name):
+        return self._pro.get(name,prop._lb+prop._rb)
+
+    def find(self,statement):
+        # Returns the names of the axioms and verified theorems stating the statement, up to names of bound variables
+        P=prop(self._nam,['silent'])
+        if self._fnd==None:
+            self._fnd={}
+            for name in self._pro:
+                self._fnd.setdefault(P._canon(self._pro[name],True),[]).append(name)
+        return list(self._fnd.get(P._canon(statement,True),[]))
+
+    def refute(self,statement,maxsize=4,tries=4096):
+        # Returns a countermodel of statement satisfying the axioms and verified theorems, see countermodel
+        return countermodel(statement,list(self._pro.values()),maxsize,tries)
+
+    def get(self,name):
+        # Returns a verified theorem or an axiom of the theory as a prop object
+        P=prop(name,['silent'])
+        if name in self._res:
+            return P.load(self._res[name])
+        if name in self._pro:
+            P.postulate(self._pro[name])
+        return P
+
+    def check(self,workers=None,cache=None):
+        # Verifies all theorems and returns the errors triggered in each of them, by name.
+        # Theorems are submitted to a pool of workers processes as soon as the theorems they recall are verified.
+        # If workers is 0, the theorems are verified one after the other in this process.
+        # If a cache file is given, theorems found there are loaded instead of verified, and the theorems verified
+        # are added to it. The file is replaced at once, so that it is never left written partly.
+        self._fnd=None
+        for name in self._scr:
+            self._pro.pop(name,None)
+            self._res.pop(name,None)
+        waiting={}       # Number of theorems not yet verified, recalled by each theorem
+        recalledby={}    # Theorems recalling each theorem
+        ready=[]
+        for name in self._scr:
+            deps=[d for d in self._dep[name] if d in self._scr]
+            waiting[name]=len(deps)
+            for d in deps:
+                recalledby.setdefault(d,[]).append(name)
+            if len(deps)==0:
+                ready.append(name)
+        keys={}
+        stored={}
+        if cache!=None:
+            for name in self._scr:
+                self._key(name,keys)
+            stored=_readcache(cache)
+        self._rep={}
+        running={}
+        pool=None
+        if workers!=0:
+            pool=ProcessPoolExecutor(workers)
+        try:
+            while len(ready)>0 or len(running)>0:
+                while len(ready)>0:
+                    name=ready.pop(0)
+                    if keys.get(name) in stored:
+                        self._done(name,stored[keys[name]],waiting,recalledby,ready)
+                    elif pool==None:
+                        self._done(name,_checkscript(name,self._scr[name],self._recalled(name)),waiting,recalledby,ready)
                     else:
-                        prefix=self._ma
-            for j in range(0,self._assdep[i]-1):
-                prefix=self._il+prefix
-            context='none'
-            if self._scoped==True:                
-                c=self._cont(i)
+                        running[pool.submit(_checkscript,name,self._scr[name],self._recalled(name))]=name
+                if len(running)>0:
+                    finished=wait(running,return_when=FIRST_COMPLETED)[0]
+                    for future in finished:
+                        self._done(running.pop(future),future.result(),waiting,recalledby,ready)
+        finally:
+            if pool!=None:
+                pool.shutdown()
+        for name in self._scr:
+            if name not in self._rep:
+                self._rep[name]=[' - circular recall of '+name]
+        if cache!=None:
+            stored=_readcache(cache)    # read again, as other runs may have added theorems since
+            for name in self._scr:
+                if keys[name]!=None and name in self._res:
+                    stored[keys[name]]=self._res[name]
+            temporary=cache+'.'+str(os.getpid())+'.tmp'
+            with open(temporary,'w',encoding='utf-8') as f:
+                json.dump(stored,f)
+            os.replace(temporary,cache)
+        self._rep={name:self._rep[name] for name in self._scr}
+        return self._rep
+
+    def _key(self,name,keys):
+        # Content hash of the script of a theorem and of the propositions it recalls (None for circular recalls)
+        if name in keys:
+            return keys[name]
+        keys[name]=None
+        content=[_cachever,name]
+        for step in self._scr[name]:
+            content.append([{'prop':x._nam,'statement':x.getstatement()} if type(x)==prop else x for x in step])
+        for d in self._dep[name]:
+            if d in self._scr:
+                d=self._key(d,keys)
+                if d==None:
+                    return None
+                content.append(d)
             else:
-                c=self._noncont(i)
-            if len(c)>0:
-                context=c[0] 
-            for j in range(1,len(c)):
-                context=context+','+c[j] 
-            line=self._lin[i].replace(self._rb+self._lb, self._rb+' '+self._lb)
-            line=line.replace(self._im,' => ')
-            print(' '+prefix+''+line+' /L'+str(i+1)+': '+self._rea[i]+'.')
+                content.append([d,self._pro.get(d)])
+        keys[name]=hashlib.sha256(json.dumps(content).encode('utf-8')).hexdigest()
+        return keys[name]
+
+    def _recalled(self,name):    # Statements of the propositions of the theory recalled by a theorem
+        return {d:self._pro[d] for d in self._dep[name] if d in self._pro}
+
+    def _done(self,name,result,waiting,recalledby,ready):    # Records a verified theorem and releases the theorems recalling it
+        self._res[name]=result
+        self._pro[name]=result['statement']
+        self._rep[name]=[h for h in result['history'] if h.startswith(' - ')]
+        for t in recalledby.get(name,[]):
+            waiting[t]=waiting[t]-1
+            if waiting[t]==0:
+                ready.append(t)
+
+########################################################################################### 
+# PROOF SEARCH                                                                            #
+# search(goal,recalled) looks for a proof of goal from the recalled propositions. It runs  #
+# rounds of forward steps (application, left and right substitution, self-equation) on    #
+# the statements known so far, keeping only steps stating something new, until the goal   #
+# statements are all stated; they are then restated together (after synapsis if the goal  #
+# is an implication). The proof found is replayed into a new theorem by the usual steps.  #
+###########################################################################################
+def search(goal,recalled=[],name='Search',depth=3,steps=2000,seconds=10.0,options=[],refute=False):
+    # Returns the theorem proving goal, or None if no proof was found within depth rounds, steps attempted
+    # steps or the given number of seconds. If refute is set, a small countermodel is looked for first.
+    if refute and countermodel(goal,recalled,3,1024)!=None:
+        return None
+    deadline=time.monotonic()+seconds
+    S=prop(name,['silent'])
+    S.t(name)
+    script=[]
+    tried={}
+    budget=[steps]
+    def run(step,keep=False):    # Makes a step, keeping it if it is valid and states something new (or if keep)
+        budget[0]=budget[0]-1
+        n=S._curlin
+        getattr(S,step[0])(*step[1:])
+        if not keep:
+            new=False
+            if S._curlin==n+1 and not S._stp[n][2]:
+                for c in S._canonstats(n):
+                    if len(S._can[c])==1:
+                        new=True
+            if not new:
+                if S._curlin==n+1:
+                    S.x()
+                return False
+        script.append(step)
+        return True
+    def found():
+        return all(S._stated(t)!=None for t in targets)
+    def out():
+        return budget[0]<=0 or time.monotonic()>deadline
+
+    G=S._tree(goal).kids()
+    implication=False
+    if len(G)==1 and G[0].decompose()[0]==['',S._im]:
+        implication=True
+        premise,conclusion=G[0].decompose()[1]
+        targets=S._tree(conclusion).stats
+    else:
+        targets=S._tree(goal).stats
+    if len(targets)==0:
+        return None
+    for pro in recalled:
+        run(('c',pro),True)
+    if implication:
+        run(('a',premise),True)
+    for t in targets:    # self-equations in the goal
+        d=S._tree(t).kids()[0].decompose()
+        if d[0]==['',S._eq] and len(d[1])==2 and d[1][0]==d[1][1] and S._stated(d[1][0])!=None:
+            run(('e',)+tuple(S._stated(d[1][0])))
+    for r in range(0,depth):
+        if found() or out():
+            break
+        facts=list(S._acs.keys())
+        for st in facts:
+            if found() or out():
+                break
+            t=S._tree(st).kids()[0]
+            constants,statements=t.decompose()
+            if constants==['',S._im]:
+                lineno,ref=S._stated(st)
+                for linerefs in S._concretizations(lineno,ref,S._nextcont()):
+                    key=(st,tuple([S._par[l-1].stats[p-1] for l,p in linerefs]))
+                    if key in tried:
+                        continue
+                    tried[key]=None
+                    run(('d',lineno,linerefs,ref))
+                    if found() or out():
+                        break
+            elif constants==['',S._eq] and len(statements)==2:
+                for other in facts:
+                    if out():
+                        break
+                    for side in (0,1):
+                        key=(st,other,side)
+                        if key in tried or len(S._tree(other).occurrences(S._tree(statements[1-side]).stats))==0:
+                            continue
+                        tried[key]=None
+                        eqline,eqref=S._stated(st)
+                        lineno,linref=S._stated(other)
+                        run(('ls' if side==0 else 'rs',eqline,lineno,[],eqref,linref))
+    if not found():
+        return None
+    run(('r',[S._stated(t) for t in targets]),True)
+    if implication:
+        run(('s',),True)
+    P=prop(name,options)
+    P.t(name)
+    for step in script:
+        getattr(P,step[0])(*step[1:])
+    if len(P.errors())>0 or P._canon(P.getstatement(),True)!=P._canon(goal,True):
+        return None
+    return P
+
+########################################################################################### 
+# COUNTERMODELS                                                                           #
+# countermodel(conjecture,axioms) looks for an interpretation on a few elements where the #
+# axioms hold and the conjecture fails, which shows that it cannot be proved from them.   #
+# Statements are read as first order formulas: a statement is the conjunction of its      #
+# outer statements, the variables it states being existential; an argument [[A]:[B]] is   #
+# an implication, the variables stated in [A] being universal; [[x]=[y]] is equality,     #
+# [![]] is false and any other formula is a predicate of its statements, read as terms (a #
+# formula read as a term is a function of its statements). Variables that are never       #
+# stated are universal. As the value of such a function is not tied to the truth of the   #
+# formula, no countermodel is looked for if a formula is read both ways, or if a false,   #
+# compound, argument or equality statement is read as a term. Predicates and functions    #
+# are tensors over domains of 1 to maxsize elements; each domain size is tried on all     #
+# interpretations if there are at most tries of them, and on tries random ones otherwise, #
+# in batches evaluated at once.                                                           #
+# Requires numpy.                                                                         #
+###########################################################################################
+def countermodel(conjecture,axioms=[],maxsize=4,tries=4096,budget=1<<22,seed=0):
+    # Returns an interpretation where the axioms (prop objects or statements) hold and the conjecture fails, as a
+    # dict with the size of the domain, the true cells of each predicate and the table of each function, or None
+    # if none was found. Elements are the numbers 0,1,...; a batch holds at most budget truth values.
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('sofia.countermodel requires numpy')
+    R=_formulas()
+    formulas=[R.read(a if type(a)==str else a.getstatement()) for a in axioms]
+    goal=R.read(conjecture)
+    if R.mixed or any(key in R.funs for key in R.preds):
+        return None
+    V=max([f[2] for f in formulas+[goal]])
+    symbols=[('p',key,R.preds[key]) for key in R.preds]+[('f',key,R.funs[key]) for key in R.funs]
+    rng=numpy.random.default_rng(seed)
+    for n in range(1,maxsize+1):
+        if n**V>budget:
+            break
+        total=2**sum([n**s[2] for s in symbols if s[0]=='p'])*n**sum([n**s[2] for s in symbols if s[0]=='f'])
+        count=min(total,tries)
+        size=max(1,min(count,budget//n**V))
+        start=0
+        while start<count:
+            W=_world(numpy,n,min(size,count-start),V)
+            W.fill(symbols,rng,start if total<=tries else None)
+            start=start+W.B
+            fails=~W.holds(goal)
+            for f in formulas:
+                if not fails.any():
+                    break
+                fails=fails&W.holds(f)
+            found=numpy.flatnonzero(fails)
+            if len(found)>0:
+                return W.describe(int(found[0]),R.name)
+    return None
+
+class _formulas:   # Reads statements as formulas for countermodel, collecting their predicates and functions
+    def __init__(self):
+        self.P=prop('Countermodel',['silent'])
+        self.preds={}     # Number of arguments of each predicate, by its shape
+        self.funs={}      # Number of arguments of each function, by its shape
+        self.depth=0
+        self.mixed=False  # Whether a statement read as a term has a logical meaning (false, compound, argument, equality)
+
+    def read(self,statement):
+        # Returns the formula stated by statement, the axis of its first unstated variable and its number of axes.
+        # Each variable is an axis of the truth values, stated variables taking the first free axis in their scope.
+        self.depth=0
+        free={}
+        new,parts,env=self._stats(statement,{},free)
+        base=self.depth
+        return ('all',[base+k for k in range(0,len(free))],('ex',new,('and',parts))),base,base+len(free)
+
+    def name(self,key):      # The name of a predicate or function, with _ for its arguments
+        P=self.P
+        return ''.join([P._lb+'_'+P._rb if c==None else c for c in key])
+
+    def _key(self,t):        # The shape of a formula, keeping empty statements
+        P=self.P
+        return tuple([x if type(x)==str else (P._lb+P._rb if len(x.items)==0 else None) for x in t.items])
+
+    def _stats(self,text,env,free):
+        # Returns the variables text states, the formulas of its other statements and the variables in their scope
+        P=self.P
+        kids=P._tree(text).kids()
+        env=dict(env)
+        new=[]
+        for x in kids:
+            if x.isvar(P._lb,P._rb) and x.items[0] not in env:
+                env[x.items[0]]=len(env)
+                new.append(len(env)-1)
+                self.depth=max(self.depth,len(env))
+        return new,[self._stat(x,env,free) for x in kids if not x.isvar(P._lb,P._rb)],env
+
+    def _stat(self,t,env,free):    # The formula of a single statement
+        P=self.P
+        constants,statements=P._decomposestat(t.text)
+        if all(c=='' for c in constants):
+            new,parts,env=self._stats(''.join(statements),env,free)
+            return ('ex',new,('and',parts))
+        if all(c.replace(P._im,'')=='' for c in constants):
+            return self._argument(P._extractargstat(t.text),env,free)
+        key=self._key(t)
+        if key==(P._f,P._lb+P._rb):
+            return ('false',)
+        args=[self._term(x,env,free) for x in t.items if type(x)==tree and len(x.items)>0]
+        if key==(None,P._eq,None):
+            return ('eq',args[0],args[1])
+        self.preds[key]=len(args)
+        return ('pred',key,args)
+
+    def _argument(self,stats,env,free):
+        new,parts,env=self._stats(stats[0],env,free)
+        if len(stats)>2:
+            rest=self._argument(stats[1:],env,free)
+        else:
+            more,conclusion,_=self._stats(stats[1],env,free)
+            rest=('ex',more,('and',conclusion))
+        return ('all',new,('imp',('and',parts),rest))
+
+    def _term(self,t,env,free):
+        P=self.P
+        if t.isvar(P._lb,P._rb):
+            if t.items[0] in env:
+                return ('var',env[t.items[0]])
+            free.setdefault(t.items[0],len(free))
+            return ('free',free[t.items[0]])
+        key=self._key(t)
+        args=[self._term(x,env,free) for x in t.items if type(x)==tree and len(x.items)>0]
+        if key==(None,):
+            return args[0]
+        if key==(P._f,P._lb+P._rb) or all(c==None or c.replace(P._im,'')=='' or c==P._eq for c in key):
+            self.mixed=True
+        self.funs[key]=len(args)
+        return ('fun',key,args)
+
+class _world:    # A batch of interpretations on a domain of n elements, evaluated at once by countermodel
+    def __init__(self,numpy,n,B,V):
+        self.np=numpy
+        self.n=n
+        self.B=B
+        self.base=0
+        self.preds={}     # Truth values of each predicate, with an axis for the batch and one per argument
+        self.funs={}      # Values of each function, likewise
+        self.true=numpy.ones((B,)+(1,)*V,dtype=numpy.bool_)
+        self.batch=numpy.arange(B).reshape((B,)+(1,)*V)
+        self.axes=[numpy.arange(n).reshape((1,)*(1+v)+(n,)+(1,)*(V-1-v)) for v in range(0,V)]
+
+    def fill(self,symbols,rng,start=None):
+        # Interprets the symbols randomly, or as the interpretations numbered from start on if start is given
+        np=self.np
+        n=self.n
+        if start!=None:
+            codes=np.arange(start,start+self.B,dtype=np.int64)
+            place=1
+        for kind,key,arity in symbols:
+            shape=(self.B,)+(n,)*arity
+            radix=2 if kind=='p' else n
+            if start!=None:
+                cells=n**arity
+                values=(codes[:,None]//(place*radix**np.arange(cells,dtype=np.int64))[None,:])%radix
+                place=place*radix**cells
+                values=values.reshape(shape)
+            elif kind=='p':
+                values=rng.random(shape)<rng.random((self.B,)+(1,)*arity)
+            else:
+                values=rng.integers(0,n,shape)
+            if kind=='p':
+                self.preds[key]=values.astype(np.bool_)
+            else:
+                self.funs[key]=values
+
+    def holds(self,formula):   # Truth values of a formula as read by _formulas, one per interpretation
+        f,self.base,V=formula
+        return self.np.broadcast_to(self._truth(f),self.true.shape).reshape(self.B)
+
+    def _truth(self,f):
+        if f[0]=='and':
+            out=self.true
+            for g in f[1]:
+                out=out&self._truth(g)
+            return out
+        if f[0]=='imp':
+            return ~self._truth(f[1])|self._truth(f[2])
+        if f[0]=='all' or f[0]=='ex':
+            out=self._truth(f[2])
+            for axis in f[1]:
+                out=out.all(axis=1+axis,keepdims=True) if f[0]=='all' else out.any(axis=1+axis,keepdims=True)
+            return out
+        if f[0]=='false':
+            return ~self.true
+        if f[0]=='eq':
+            return self._term(f[1])==self._term(f[2])
+        return self.preds[f[1]][(self.batch,)+tuple([self._term(t) for t in f[2]])]
+
+    def _term(self,t):
+        if t[0]=='var':
+            return self.axes[t[1]]
+        if t[0]=='free':
+            return self.axes[self.base+t[1]]
+        return self.funs[t[1]][(self.batch,)+tuple([self._term(s) for s in t[2]])]
+
+    def describe(self,b,name):   # The interpretation b as a dict, naming symbols by name
+        out={'size':self.n,'predicates':{},'functions':{}}
+        for key in self.preds:
+            out['predicates'][name(key)]=self.np.argwhere(self.preds[key][b]).tolist()
+        for key in self.funs:
+            table=self.funs[key][b]
+            out['functions'][name(key)]=[list(i)+[int(table[i])] for i in self.np.ndindex(table.shape)]
+        return out
 
 class set:
     _s='set'
@@ -1540,7 +3384,7 @@ class set:
         y=C._lb+y+C._rb
         s=C._lb+x+self._i+X+self._t+stat+C._rb
         C.postulate(C._lb+context+X+C._lb+X+self._s+C._rb+C._im+C._lb+s+C._lb+s+self._s+C._rb+C._lb+C._lb+y+C._im+C._lb+C._lb+y+self._i+s+C._rb+C._eq+stat.replace(x,y)+C._rb+C._rb+C._rb+C._rb+C._rb)
-        print(C._lb+context+X+C._lb+X+self._s+C._rb+C._im+C._lb+s+C._lb+s+self._s+C._rb+C._lb+C._lb+y+C._im+C._lb+C._lb+y+self._i+s+C._rb+C._eq+stat.replace(x,y)+C._rb+C._rb+C._rb+C._rb+C._rb)
+        C._say(C._lb+context+X+C._lb+X+self._s+C._rb+C._im+C._lb+s+C._lb+s+self._s+C._rb+C._lb+C._lb+y+C._im+C._lb+C._lb+y+self._i+s+C._rb+C._eq+stat.replace(x,y)+C._rb+C._rb+C._rb+C._rb+C._rb)
         return C
 class nat:
     _s='1+'
@@ -1616,4 +3460,142 @@ class bool:
         print(' ================')
         print(' Boolean axiom building commands. For a given Boolean axiom builder B, the following axiom building commands are available.')
         print('  ■ False universality: B.f("[blabla[X][Y]]","[X][Y]") will return the axiom "[[X][Y][![]]:[blabla[X][Y]]]" as a prop object.')
-        print('  ■ Double negation: B.n("[blabla[X][Y]]","[X][Y]") will return the axiom "[[X][Y][[[blabla[X][Y]]:[![]]]:[![]]]]:[blabla[X][Y]]]".')
\ No newline at end of file
+        print('  ■ Double negation: B.n("[blabla[X][Y]]","[X][Y]") will return the axiom "[[X][Y][[[blabla[X][Y]]:[![]]]:[![]]]]:[blabla[X][Y]]]".')
+
+########################################################################################### 
+# PROOF SCRIPTS (command line)                                                            #
+# python -m sofia check FILE... checks proof script files without executing any Python.   #
+# Each line of a proof script is one of the following (blank lines and # comments aside): #
+#   axiom NAME: [statement]       postulates an axiom                                     #
+#   theorem NAME                  starts the proof of a theorem                           #
+#   a [statement]                 proof steps of the theorem, as the prop methods with    #
+#   aa [statement]                  the same names; the arguments of r, e, d, ls and rs   #
+#   c NAME                          are Python literals separated by commas, e.g.         #
+#   r [[1,1]],["x"]                 d 2,[[1,1]]                                           #
+#   e 2,1                                                                                 #
+#   d 2,[[1,1]],3                                                                         #
+#   ls 1,2,[],1,1                                                                         #
+#   rs 1,2,[],1,1                                                                         #
+#   s                                                                                     #
+#   x                                                                                     #
+#   end                           ends the proof of the theorem                           #
+# Theorems may recall the axioms and theorems stated before them, also in earlier files.  #
+# A line whose arguments are not of the types its step takes is invalid. If a step fails  #
+# all the same, the rest of its theorem is skipped and the theorem is neither reported    #
+# nor recalled.                                                                           #
+# The report is printed as JSON; the exit status is 0 if all proofs are correct, 1 if     #
+# some proof has errors and 2 if some file cannot be read or has invalid lines.           #
+###########################################################################################
+_steps={'a':'s','aa':'s','c':'n','r':'l','e':'l','d':'l','ls':'l','rs':'l','s':'','x':''}   # Arguments: statement, name, literals or none
+_literals={'r':('pairs','names'),'e':('int','int'),'d':('int','refs','int','int'),    # Types of the literal arguments
+           'ls':('int','int','instances','int','int'),'rs':('int','int','instances','int','int')}
+
+def _fits(x,kind):    # Whether a literal argument of a step is of the type (in _literals) the step takes there
+    if kind=='int':
+        return isinstance(x,int)
+    if type(x)!=list:
+        return False
+    if kind=='pairs':     # line and statement numbers, e.g. [[1,1],[2,1]]
+        return all(type(e)==list and all(isinstance(i,int) for i in e) for e in x)
+    if kind=='names':     # new variable names
+        return all(type(e)==str for e in x)
+    if kind=='refs':      # line numbers, or line and statement numbers
+        return all(isinstance(e,int) or (type(e)==list and all(isinstance(i,int) for i in e)) for e in x)
+    return all(isinstance(e,int) or (type(e) in (list,tuple) and len(e)>0 and isinstance(e[0],int)) for e in x)    # instances
+
+def _checkfile(path,known):
+    # Checks a proof script file, where known maps the names of propositions stated before to prop objects.
+    # Returns the report of the file.
+    report={'file':path,'propositions':[],'invalid':[]}
+    P=None
+    failed=False    # whether a step of P failed, leaving its proof unfinished
+    def close(lineno):
+        if P==None or failed:
+            return
+        try:
+            entry={'name':P._nam,'type':P._proptype,'statement':P.getstatement(),'errors':P.errors()}
+        except Exception as e:
+            report['invalid'].append({'line':lineno,'error':'cannot report '+P._nam+': '+repr(e)})
+            return
+        report['propositions'].append(entry)
+        known[P._nam]=P
+    try:
+        f=open(path,encoding='utf-8')
+    except OSError as e:
+        report['invalid'].append({'line':0,'error':str(e)})
+        return report
+    lineno=0
+    with f:
+        for lineno,text in enumerate(f,1):
+            text=text.strip()
+            if text=='' or text.startswith('#'):
+                continue
+            command,_,rest=text.partition(' ')
+            rest=rest.strip()
+            if command=='axiom':
+                close(lineno)
+                P=None
+                name,_,statement=rest.partition(':')
+                A=prop(name.strip(),['silent'])
+                A.postulate(statement.strip())
+                report['propositions'].append({'name':A._nam,'type':A._proptype,'statement':A.getstatement(),'errors':A.errors()})
+                known[A._nam]=A
+            elif command=='theorem':
+                close(lineno)
+                P=prop(rest,['silent'])
+                P.t(rest)
+                failed=False
+            elif command=='end':
+                close(lineno)
+                P=None
+            elif command in _steps and P!=None:
+                if failed:
+                    continue
+                if _steps[command]=='s':
+                    args=[rest]
+                elif _steps[command]=='n':
+                    args=[known.get(rest,rest)]
+                elif _steps[command]=='l' and rest!='':
+                    try:
+                        args=list(ast.literal_eval('('+rest+',)'))
+                    except (ValueError,TypeError,SyntaxError,MemoryError,RecursionError):
+                        report['invalid'].append({'line':lineno,'error':'invalid arguments: '+rest})
+                        continue
+                    kinds=_literals[command]
+                    if len(args)>len(kinds) or not all(_fits(args[i],kinds[i]) for i in range(0,len(args))):
+                        report['invalid'].append({'line':lineno,'error':'arguments of the wrong type: '+rest})
+                        continue
+                else:
+                    args=[]
+                try:
+                    getattr(P,command)(*args)
+                except Exception as e:
+                    report['invalid'].append({'line':lineno,'error':'step failed, '+P._nam+' is not checked further: '+repr(e)})
+                    failed=True
+            elif command in _steps:
+                report['invalid'].append({'line':lineno,'error':'proof step outside a theorem: '+text})
+            else:
+                report['invalid'].append({'line':lineno,'error':'unknown command: '+command})
+        close(lineno+1)
+    return report
+
+def main(argv=None):
+    if argv==None:
+        argv=sys.argv[1:]
+    if len(argv)<2 or argv[0]!='check':
+        sys.stderr.write('usage: python -m sofia check FILE...\n')
+        return 2
+    known={}
+    reports=[_checkfile(path,known) for path in argv[1:]]
+    status=0
+    for report in reports:
+        if len(report['invalid'])>0:
+            status=2
+        elif status==0 and any(len(x['errors'])>0 for x in report['propositions']):
+            status=1
+    json.dump({'files':reports,'status':status},sys.stdout,indent=1,ensure_ascii=False)
+    sys.stdout.write('\n')
+    return status
+
+if __name__=='__main__':
+    sys.exit(main())
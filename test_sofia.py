@@ -0,0 +1,607 @@
+import gc
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tracemalloc
+import pytest
+import sofia
+
+
+def test_countermodel_does_not_refute_provable_statements():
+    pytest.importorskip('numpy')
+    goal='[[a][b][[[a]P]=[[b]P]][[a]P]:[[b]P]]'
+    assert sofia.search(goal,[])!=None
+    assert sofia.countermodel(goal)==None
+    assert sofia.search(goal,[],refute=True)!=None
+
+
+def test_countermodel_refutes_unprovable_statements():
+    pytest.importorskip('numpy')
+    model=sofia.countermodel('[[x][[x]P]:[[x]Q]]')
+    assert model!=None
+    assert any(x not in model['predicates']['[_]Q'] for x in model['predicates']['[_]P'])
+    assert sofia.countermodel('[[x][[x]P]:[[x]P]]')==None
+
+
+def proof():
+    # A short proof with nested blocks and an application
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    P.a('[[x][[x]p]:[[x]q]]')
+    P.a('[y][[y]p]')
+    P.d(1,[[2,1]])
+    P.s()
+    P.s()
+    return P
+
+
+def made(steps):
+    # The proof made from scratch by the given steps
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    for step in steps:
+        getattr(P,step[0])(*step[1:])
+    return P
+
+
+def same(P,Q):
+    return all(list(getattr(P,x))==list(getattr(Q,x)) for x in ('_lin','_rea','_assdep','_ass')) and P.errors()==Q.errors()
+
+
+def test_edit_makes_the_proof_made_from_scratch():
+    P=proof()
+    P.edit(2,('a','[z][[z]p]'))
+    assert same(P,made([('a','[[x][[x]p]:[[x]q]]'),('a','[z][[z]p]'),('d',1,[[2,1]]),('s',),('s',)]))
+    P.edit(3,('e',2))
+    assert same(P,made([('a','[[x][[x]p]:[[x]q]]'),('a','[z][[z]p]'),('e',2),('s',),('s',)]))
+
+
+def test_insert_makes_the_proof_made_from_scratch():
+    # The later steps refer to the lines they did, which come one line later
+    P=proof()
+    P.insert(2,('a','[w]'))
+    assert same(P,made([('a','[[x][[x]p]:[[x]q]]'),('a','[w]'),('a','[y][[y]p]'),('d',1,[[3,1]]),('s',),('s',)]))
+    P=proof()
+    P.insert(3,('e',2))
+    assert same(P,made([('a','[[x][[x]p]:[[x]q]]'),('a','[y][[y]p]'),('e',2),('d',1,[[2,1]]),('s',),('s',)]))
+
+
+def randomproof(seed):
+    # A proof made by random steps, some of them failing, with lines deleted and blocks closed in between
+    rnd=random.Random(seed)
+    statements=['[x]','[x][y]','[[x]=[y]]','[[x][[x]p]:[[x]q]]','[y][[y]p]','[z][[z]=[x]]','[[x]:[[x]=[x]]]','[u][[u]r[x]]']
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    for k in range(rnd.randint(1,25)):
+        rule=rnd.choice(['a','a','aa','s','s','x','e','d','r'])
+        n=max(P._curlin,1)
+        if rule in ('a','aa'):
+            getattr(P,rule)(rnd.choice(statements))
+        elif rule in ('s','x'):
+            getattr(P,rule)()
+        elif rule=='e':
+            P.e(rnd.randint(1,n),rnd.randint(1,2))
+        elif rule=='d':
+            P.d(rnd.randint(1,n),[[rnd.randint(1,n),1]])
+        else:
+            P.r([[rnd.randint(1,n),1]],rnd.choice([[],['w']]))
+    return P
+
+
+def test_context_stack_agrees_with_the_lines(monkeypatch):
+    proofs=[randomproof(seed) for seed in range(200)]
+    stacked=[(P._cont(P._curlin-1),P._noncont(P._curlin-1)) for P in proofs if P._curlin>0]
+    assert sum(len(x[0])>0 for x in stacked)>50
+    monkeypatch.setattr(sofia.prop,'_stacked',lambda self,linenumber: False)    # worked out from the lines instead
+    assert stacked==[(P._cont(P._curlin-1),P._noncont(P._curlin-1)) for P in proofs if P._curlin>0]
+
+
+def test_block_index_agrees_with_the_depths():
+    def accessible(P,line1,line2):    # Worked out by walking the assumption depths
+        i=line1
+        while i<line2 and P._assdep[i]>=P._assdep[line1]:
+            i=i+1
+        return line1<=line2 and P._assdep[i]>=P._assdep[line1]
+    for seed in range(200):
+        P=randomproof(seed)
+        n=P._curlin
+        assert all(P._logdep(i,j)==accessible(P,i,j) for i in range(0,n) for j in range(0,n))
+        assert not P._logdep(-1,n-1) and not P._logdep(n-1,-1)
+
+
+def test_statement_index_holds_the_accessible_lines():
+    for seed in range(200):
+        P=randomproof(seed)
+        index={}
+        for i in range(0,P._curlin):
+            if P._logdep(i,P._curlin-1):
+                for x in P._par[i].stats:
+                    index[x]=index.get(x,())+(i,)
+        assert P._acs==index
+
+
+def test_apply_takes_the_first_accessible_line_stating_a_premise():
+    P=made([('a','[[[]P]:[[]Q]]'),('a','[[]P]'),('e',2),('s',),('a','[[]R]'),('aa','[[]P]'),('aa','[[]P]'),('d',1,[])])
+    assert P._lin[-1]=='[[]Q]' and P.errors()==[]
+    assert P._acs['[[]P]']==(5,6) and P._stp[-1][1]==(0,5)    # not line 2, in a block closed since
+    P.x()
+    P.x()
+    assert P._acs['[[]P]']==(5,) and '[[]Q]' not in P._acs
+    P.x()
+    assert '[[]P]' not in P._acs
+
+
+def test_statement_is_concluded_again_after_changes(monkeypatch):
+    P=proof()
+    statements=[P.getstatement()]
+    P.x()
+    statements.append(P.getstatement())
+    P.s()
+    statements.append(P.getstatement())
+    P.edit(2,('a','[z][[z]p]'))
+    statements.append(P.getstatement())
+    assert statements==[proof().getstatement(),'[]',proof().getstatement(),'[[[x][[x]p]:[[x]q]]:[[z][[z]p]:[[z]q]]]']
+    for seed in range(50):
+        Q=randomproof(seed)
+        if Q._curlin>0:
+            assert Q.getstatement()==Q.render()[2]
+    def render(self):
+        raise AssertionError('the proof was rendered')
+    monkeypatch.setattr(sofia.prop,'render',render)
+    R=sofia.prop('R',['silent'])
+    R.t('R')
+    R.c(P)
+    assert R.getstatement()==P.getstatement()
+
+
+def test_fresh_variable_names():
+    def renamed(varname,notvars,pr="'",pm=3,ss=''):    # As names were chosen by probing a list
+        newname=varname
+        primecount=varname.count(pr)
+        i=0
+        while newname in notvars:
+            if primecount<pm and varname[-1]!=pr:
+                newname=newname+pr
+                primecount=primecount+1
+            else:
+                newname=varname+ss+str(i)
+                i=i+1
+        return newname
+    P=sofia.prop('T',['silent'])
+    assert P._renamevar('x',['x'])=="x'" and P._renamevar('y',['x'])=='y'
+    assert P._renamevar('x',['x',"x'","x''","x'''"])=='x0' and P._renamevar("x'",["x'"])=="x'0"
+    rnd=random.Random(0)
+    names=['x',"x'","x''","x'''",'x0','x1',"x'0",'y','y0']
+    for k in range(500):
+        taken=rnd.sample(names,rnd.randint(0,len(names)))
+        for varname in ('x',"x'",'y'):
+            assert P._renamevar(varname,taken)==renamed(varname,taken)
+            assert sofia._names(dict.fromkeys(taken),"'",2,'_').fresh(varname)==renamed(varname,taken,"'",2,'_')
+    fresh=sofia._names({'x':None})
+    assert fresh.fresh('x')=="x'" and fresh.fresh('x')=="x'"    # the same name for the same variable
+
+
+def test_variables_are_renamed_simultaneously():
+    assert sofia._subvars('[[x]R[y]][xx][[x]=[y]]',{'x':'[y]','y':'[x]'})=='[[y]R[x]][xx][[y]=[x]]'
+    P=sofia.prop('T',['silent'])
+    assert P._rename('[[x]R[y]][x y]',['x','y'],['y','x'])=='[[y]R[x]][x y]'
+    P=made([('a','[[[u]R[v]]:[[v]R[u]]]'),('r',[[1,1]],['w'])])
+    assert P._lin[-1]=='[[[w]R[v]]:[[v]R[w]]]' and P.errors()==[]
+    P=made([('a','[x][y][[x]R[y]]'),('r',[[1,9]],[])])
+    assert P._lin[-1]=='[]' and P.errors()==[]    # a position that is no statement restates nothing
+
+def test_replay_takes_over_an_exported_proof():
+    P=proof()
+    Q=sofia.prop('T',['silent']).replay(json.loads(json.dumps(P.export())))
+    assert list(Q._lin)==list(P._lin) and list(Q._rea)==list(P._rea)
+    assert Q.export()['hashes']==P.export()['hashes']
+
+
+def test_replay_checks_tampered_lines_again():
+    P=proof()
+    log=P.export()
+    log['lines'][2]='[[y]r]'
+    log['reasons'][2]='made up'
+    Q=sofia.prop('T',['silent']).replay(log)
+    assert list(Q._lin)==list(P._lin) and list(Q._rea)==list(P._rea)
+
+
+def test_replay_rejects_steps_that_are_not_proof_steps(tmp_path):
+    P=proof()
+    log=P.export()
+    log['steps'][1]=['journal',str(tmp_path/'written')]
+    log['hashes'][1]=''
+    Q=sofia.prop('T',['silent']).replay(log)
+    assert Q._curlin==1
+    assert not (tmp_path/'written').exists()
+
+
+def test_check_verifies_blocks_again():
+    P=proof()
+    assert P.check(0)==[]
+    assert P.check(2)==[]
+
+
+def test_check_makes_only_proof_steps(tmp_path):
+    P=proof()
+    data=P.dump()
+    for x in ('lines','reasons','depths','assumptions'):
+        data[x]=data[x][:1]
+    lines,history=sofia._checkpart(data,[('journal',str(tmp_path/'written')),('a','[z]')])
+    assert lines==[]
+    assert not (tmp_path/'written').exists()
+
+
+def test_restatement_without_new_variable_names():
+    # As in Examples.txt (Subset Reflexivity, line 4): the statements are restated as they are
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    P.a('[X][[X] is a set]')
+    P.a('[[x] in [X]]')
+    P.r([[2,1]])
+    P.r([[1,2],[2,1]])
+    assert list(P._lin)[2:]==['[[x] in [X]]','[[X] is a set][[x] in [X]]']
+    assert P.errors()==[]
+
+
+def test_premises_are_matched_up_to_names_of_bound_variables():
+    P=made([('a','[[[x][[x]p]:[[x]q]]:[r]]'),('a','[[y][[y]p]:[[y]q]]'),('d',1,[])])
+    assert P.errors()==[] and P._rea[2]=='application of L1.1'
+    T=sofia.theory('T')
+    T.ax('A','[[x][[x]p]:[[x]q]]')
+    assert T.find('[[z][[z]p]:[[z]q]]')==['A'] and T.find('[[z][[z]q]:[[z]p]]')==[]
+
+
+def substituted(rule,instance,line):
+    # The line made by substituting [b] for [a] (rs) or the other way (ls) in the second statement of line
+    P=made([('a','[a][b][[a]=[b]]'),('aa',line),(rule,1,2,instance,3,2)])
+    assert P.errors()==[]
+    return P._lin[-1]
+
+
+def test_substitution_instances_are_numbered_in_the_original_line():
+    assert substituted('rs',[],'[a][[[a]P][a]][[a]Q]')=='[[[b]P][b]]'
+    assert substituted('rs',[1],'[a][[[a]P][a]][b]')=='[[[b]P][a]]'
+    assert substituted('rs',[2],'[a][[[a]P][a]][b]')=='[[[a]P][b]]'
+    assert substituted('rs',[2,1],'[a][[[a]P][a]][b]')=='[[[b]P][b]]'
+    assert substituted('rs',[1,3],'[a][[a][a][a]][b]')=='[[b][a][b]]'    # not the first of the line made so far
+    assert substituted('ls',[2],'[a][[[b]P][[b]=[b]]][b]')=='[[[b]P][[a]=[b]]]'
+    assert substituted('ls',[2,3],'[a][[[b]P][[b]=[b]]][b]')=='[[[b]P][[a]=[a]]]'
+
+
+def test_substitution_replaces_whole_statements_only():
+    assert substituted('rs',[],'[a][[[aa]P][a a]][b]')=='[[[aa]P][a a]]'
+    assert substituted('rs',[],'[a][[a][[a]]][b]')=='[[b][[b]]]'
+
+
+def test_occurrences_give_number_offset_and_depth():
+    P=made([('a','[a][b][[a]=[b]]'),('aa','[a][[[a]P][a][b][[a][b]]][b]')])
+    assert P.occurrences('[a]',2,2)==[(1,2,2),(2,7,1),(3,14,2)]
+    assert P.occurrences('[a][b]',2,2)==[(1,7,1),(2,14,2)]
+    assert P.occurrences('[c]',2,2)==[] and P.occurrences('[a]',2,9)==[] and P.occurrences('[a',2,2)==[]
+    found=P.occurrences('[a]',2,2)
+    found.pop()
+    assert len(P.occurrences('[a]',2,2))==3    # a copy of the cached occurrences
+    P.rs(1,2,P.occurrences('[a]',2,2)[1:],3,2)
+    assert P._lin[-1]=='[[[a]P][b][b][[b][b]]]' and P.errors()==[]
+
+
+def test_apply_infers_concretizations():
+    # The same line and reason as with the concretizations given
+    given=made([('a','[[x][y][[x]R[y]][[y]R[x]]:[[x]=[y]]]'),('a','[u][v][[u]R[v]][[v]R[u]]'),('d',1,[[2,1],[2,2]])])
+    found=made([('a','[[x][y][[x]R[y]][[y]R[x]]:[[x]=[y]]]'),('a','[u][v][[u]R[v]][[v]R[u]]'),('d',1,[],-1,True)])
+    assert same(found,given) and found._lin[-1]=='[[u]=[v]]'
+    P=made([('a','[[x][y][[x]R[y]][[y]S]:[[x]T[y]]]'),('a','[u][v][w][[u]R[v]][[u]R[w]][[w]S]'),('d',1,[],-1,True)])
+    assert P._lin[-1]=='[[u]T[w]]' and P.errors()==[]    # [v] fits the first premise only
+    P=made([('a','[[x][y][[x]R[y]][[y]R[x]]:[[x]=[y]]]'),('a','[u][v][[u]R[v]]'),('d',1,[],-1,True)])
+    assert P.errors()==[' - inval. inference at L3']
+
+
+def test_search_proves_by_substitution():
+    assert sofia.search('[[a][b][[[a]P]=[[b]P]][[a]P]:[[b]P]]',[])!=None
+
+
+def library():
+    T=sofia.theory('Equality')
+    T.t('Refl',[('a','[X]'),('e',1),('s',)])
+    T.t('Sym',[('a','[X][Y][[X]=[Y]]'),('e',1,1),('rs',1,2,[1],3,1),('s',)])
+    return T
+
+
+@pytest.mark.parametrize('workers',[0,2])
+def test_check_reports_circular_and_missing_recalls(workers):
+    T=sofia.theory('T')
+    T.t('A',[('c','B'),('s',)])
+    T.t('B',[('c','A')])
+    T.t('D',[('c','A')])    # waits for A, which is never verified
+    T.t('M',[('c','Missing')])
+    T.t('C',[('a','[X]'),('e',1),('s',)])
+    T.t('N',[('c','C')])
+    report=T.check(workers)
+    assert list(report)==['A','B','D','M','C','N']
+    assert report['A']==[' - circular recall of A'] and report['B']==[' - circular recall of B']
+    assert report['D']==[' - circular recall of D']
+    assert report['M']==[' - you can only recall a sofia proposition at L1']
+    assert report['C']==[] and report['N']==[] and T.getstatement('N')=='[[X]:[[X]=[X]]]'
+    assert T.getstatement('A')=='[]'
+
+
+def test_cache_loads_verified_theorems(tmp_path,monkeypatch):
+    cache=str(tmp_path/'cache.json')
+    first=library().check(0,cache)
+    assert first=={'Refl':[],'Sym':[]}
+    assert len(json.load(open(cache,encoding='utf-8')))==2
+    def verify(*args):
+        raise AssertionError('a cached theorem was verified again')
+    monkeypatch.setattr(sofia,'_checkscript',verify)
+    T=library()
+    assert T.check(0,cache)==first
+    assert T.getstatement('Sym')=='[[X][Y][[X]=[Y]]:[[Y]=[X]]]'
+
+
+def test_cache_is_invalidated_by_changes(tmp_path):
+    cache=str(tmp_path/'cache.json')
+    library().check(0,cache)
+    T=library()
+    T.t('Refl',[('a','[X]'),('e',7),('s',)])
+    assert T.check(0,cache)['Refl']!=[]
+    T=library()
+    T.t('Use',[('c','Refl')])
+    T.check(0,cache)
+    assert T.getstatement('Use')=='[[X]:[[X]=[X]]]'
+    T.t('Refl',[('a','[Y]'),('e',1),('s',)])    # invalidates Use, which recalls it
+    T.check(0,cache)
+    assert T.getstatement('Use')=='[[Y]:[[Y]=[Y]]]'
+
+
+def test_cache_keeps_theorems_of_other_theories(tmp_path):
+    cache=str(tmp_path/'cache.json')
+    library().check(0,cache)
+    T=sofia.theory('Other')
+    T.t('Alone',[('a','[Z]'),('e',1),('s',)])
+    T.check(0,cache)
+    assert len(json.load(open(cache,encoding='utf-8')))==3
+    open(cache,'w').write('{"truncated')
+    assert library().check(0,cache)=={'Refl':[],'Sym':[]}
+    assert len(json.load(open(cache,encoding='utf-8')))==2
+
+
+def test_import_prints_nothing():
+    run=subprocess.run([sys.executable,'-c','import sofia'],capture_output=True,text=True,
+                       cwd=os.path.dirname(os.path.abspath(sofia.__file__)))
+    assert run.returncode==0 and run.stdout=='' and run.stderr==''
+
+
+def test_output_goes_to_the_sink_of_each_proposition(monkeypatch,capsys):
+    shared=[]
+    monkeypatch.setattr(sofia,'sink',shared.append)
+    own=[]
+    P=sofia.prop('P',['showing'],own.append)
+    P.t('P')
+    P.a('[x]')
+    Q=sofia.prop('Q',['showing'])
+    Q.t('Q')
+    Q.a('[x]')
+    R=sofia.prop('R',['silent'])
+    R.t('R')
+    R.a('[x]')
+    assert 'Theorem: P.' in own and 'Theorem: P.' not in shared
+    assert 'Theorem: Q.' in shared and 'Theorem: R.' not in own+shared
+    class logger:
+        lines=[]
+        def info(self,text):
+            self.lines.append(text)
+    monkeypatch.setattr(sofia,'sink',logger())
+    monkeypatch.setattr(sofia,'showing',True)
+    S=sofia.prop('S')
+    S.t('S')
+    S.a('[x]')    # shown as sofia.showing tells
+    assert 'Theorem: S.' in logger.lines
+    assert capsys.readouterr().out==''
+
+
+def test_incremental_display_ends_as_show():
+    # With a sink other than a terminal, a line whose box characters change is printed again as corrected
+    out=[]
+    P=sofia.prop('T',['incremental'],out.append)
+    P.t('T')
+    P.a('[[x][[x]p]:[[x]q]]')
+    P.a('[y][[y]p]')
+    P.d(1,[[2,1]])
+    P.s()
+    P.s()
+    shown=[]
+    P._out=shown.append
+    P.show()
+    last={}
+    for x in out:
+        if '/L' in x:
+            last[x.split('/L')[1]]=x
+    assert sorted(last.values())==sorted(x for x in shown if '/L' in x)
+    assert not any('\x1b' in x for x in out)
+    assert out[-3:]==shown[1:3]+['QED']    # the statement proved, printed again
+    P._out=out.append
+    P.a('[z]')
+    P.e(1)
+    assert out[-1]!='QED'
+    P.s()
+    assert out[-3:]==['Theorem: T.',P.getstatement(),'QED'] and P.getstatement()!=shown[2]
+
+
+def test_parse_cache_is_bounded():
+    P=sofia.prop('T',['silent'])
+    first='[[a0]p]'
+    P._tree(first)
+    for k in range(1,P._pcm+100):
+        P._tree('[[a'+str(k)+']p]')
+        if k%100==0:
+            P._tree(first)    # recently used, so kept
+    assert len(P._pc)==P._pcm
+    assert first in P._pc and '[[a1]p]' not in P._pc
+
+
+def test_historylimit_is_the_most_records_kept(monkeypatch):
+    monkeypatch.setattr(sofia,'historylimit',10)
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    for k in range(150):
+        P.a('[A]')
+        assert len(P.history())==min(k+1,10)
+    F=P.fork()
+    F.a('[B]')
+    assert P._err.total()==150 and F._err.total()==151
+    assert [r['line'] for r in P.history()]==list(range(141,151))
+    assert [r['line'] for r in F.history()]==list(range(142,152))
+    assert P.history('a',line=150)[0]['text']=='Assumed: [A]'
+
+
+def test_fork_is_continued_independently():
+    P=proof()
+    before=made([('a','[[x][[x]p]:[[x]q]]'),('a','[y][[y]p]'),('d',1,[[2,1]]),('s',),('s',)])
+    records=len(P.history())
+    F=P.fork()
+    F.edit(2,('a','[z][[z]p]'))
+    F.a('[w]')
+    assert same(P,before) and len(P.history())==records
+    P.edit(3,('e',2))
+    assert list(F._lin)[1:3]==['[z][[z]p]','[[z]q]']
+
+
+def test_restore_brings_back_the_checkpoint_each_time():
+    P=proof()
+    lines=list(P._lin)
+    P.checkpoint('done')
+    P.edit(2,('a','[z][[z]p]'))
+    P.a('[w]')
+    P.restore('done')
+    assert list(P._lin)==lines and P.getstatement()==proof().getstatement()
+    P.edit(1,('a','[[x][[x]p]:[[x]r]]'))    # changes after restoring leave the checkpoint as it was
+    P.restore('done')
+    assert list(P._lin)==lines and P.errors()==[]
+
+
+def test_minimize_keeps_the_statement():
+    P=made([('a','[[x][[x]p]:[[x]q]]'),('a','[y][[y]p]'),('e',2),('d',1,[[2,1]]),('s',),('s',)])
+    lines=list(P._lin)
+    M=P.minimize()
+    assert M.getstatement()==P.getstatement() and M.errors()==[]
+    assert same(M,proof())    # without the line of the selfequation, which is not used
+    assert list(P._lin)==lines
+    L=sofia.prop('T',['silent']).load(P.dump())    # the steps are unknown: a copy is returned
+    assert list(L.minimize()._lin)==lines
+
+
+def retained(P):
+    # Number of history records reachable from the proposition
+    seen={}
+    todo=[P]
+    count=0
+    while len(todo)>0:
+        x=todo.pop()
+        if id(x) in seen:
+            continue
+        seen[id(x)]=None
+        if type(x)==tuple and len(x)==5 and (x[0]==None or x[0] in sofia._echoes):
+            count=count+1
+        if type(x) in (tuple,list,dict,sofia.prop) or isinstance(x,sofia._plist):
+            todo.extend(gc.get_referents(x))
+    return count
+
+
+def test_proof_data_is_held_compactly():
+    P=proof()
+    with pytest.raises(AttributeError):
+        P.unknown=1    # no instance dictionary
+    assert (P._assdep._tc,P._blk._tc,P._ass._tc)==('i','i','b')
+    assert type(P._rea)==sofia._codes and len(P._rea._string)<len(P._rea)    # each reason kept once
+    F=P.fork()
+    F.r([[1,1]],[])
+    assert F._rea._string is P._rea._string and list(P._rea)==list(proof()._rea)
+    rea=pickle.loads(pickle.dumps(P._rea))
+    assert list(rea)==list(P._rea) and rea._string is not P._rea._string
+    Q=sofia.prop('T',['silent'])
+    Q.load(json.loads(json.dumps(P.dump())))
+    assert same(P,Q) and Q._rea._string is not P._rea._string
+
+def test_historylimit_bounds_the_records_held(monkeypatch):
+    monkeypatch.setattr(sofia,'historylimit',10)
+    P=sofia.prop('T',['silent'])
+    P.t('T')
+    for k in range(300):
+        P.a('[A]')
+    P.edit(5,('a','[B]'))
+    assert retained(P)==10
+    log=P.export()
+    assert sum(len(x) for x in log['records'])==9    # the last ten records but that of the edit
+    assert sofia.prop('T',['silent']).replay(log).export()['hashes']==log['hashes']
+
+
+def test_reasons_are_dropped_with_their_proofs(monkeypatch):
+    # Reasons with a new concretization each time, so that none of them is shared between the proofs
+    monkeypatch.setattr(sofia.prop,'_pc',sofia.OrderedDict())
+    monkeypatch.setattr(sofia.prop,'_pcm',64)
+    def throwaway(k):
+        return made([('a','[[x][[x]p]:[[x]q]]'),('a','[y'+str(k)+'][[y'+str(k)+']p]'),('d',1,[[2,1]])])
+    tracemalloc.start()
+    try:
+        for k in range(300):
+            throwaway(k)
+        before=tracemalloc.get_traced_memory()[0]
+        for k in range(300,1800):
+            throwaway(k)
+        grown=tracemalloc.get_traced_memory()[0]-before
+    finally:
+        tracemalloc.stop()
+    assert grown<50000
+    P=throwaway(0)
+    assert len(P._rea._string)==2
+    F=P.fork()
+    F.a('[z]')
+    assert F._rea._string is P._rea._string and list(P._rea)==['assumption','assumption','application of L1.1 (with concretization [y0])']
+
+
+def check(tmp_path,*scripts):
+    # Runs the command line checker on proof scripts (written to files in turn), returning its exit status and report
+    paths=[]
+    for script in scripts:
+        paths.append(str(tmp_path/('proof'+str(len(paths)+1)+'.txt')))
+        if script!=None:
+            open(paths[-1],'w',encoding='utf-8').write(script)
+    run=subprocess.run([sys.executable,'-m','sofia','check']+paths,capture_output=True,text=True,
+                       cwd=os.path.dirname(os.path.abspath(sofia.__file__)))
+    return run.returncode,json.loads(run.stdout)
+
+
+def test_cli_reports_each_proposition_of_each_file(tmp_path):
+    status,report=check(tmp_path,'# Equality\naxiom Eq: [[X]:[[X]=[X]]]\n\ntheorem Refl\na [X]\ne 1\ns\nend\n',
+                        'theorem Use\nc Refl\nend\n')
+    assert status==0 and report['status']==0
+    assert [x['file'] for x in report['files']]==[str(tmp_path/'proof1.txt'),str(tmp_path/'proof2.txt')]
+    assert report['files'][0]['propositions']==[
+        {'name':'Eq','type':'Axiom','statement':'[[X]:[[X]=[X]]]','errors':[]},
+        {'name':'Refl','type':'Theorem','statement':'[[X]:[[X]=[X]]]','errors':[]}]
+    assert report['files'][1]['propositions'][0]['statement']=='[[X]:[[X]=[X]]]'    # recalled from the first file
+    assert report['files'][0]['invalid']==[] and report['files'][1]['invalid']==[]
+
+
+def test_cli_exit_status(tmp_path):
+    status,report=check(tmp_path,'theorem T\na [x]\ne 7\nend\n')
+    assert status==1 and report['files'][0]['propositions'][0]['errors']!=[]
+    status,report=check(tmp_path,'theorem T\na [x]\nfoo 1\nend\ns\nd 2,[[1\n')
+    assert status==2
+    assert [x['line'] for x in report['files'][0]['invalid']]==[3,5,6]
+    status,report=check(tmp_path,'theorem T\na [x]\ne 7\nend\n',None)    # the second file is missing
+    assert status==2 and report['files'][1]['invalid'][0]['line']==0
+
+
+def test_cli_reports_steps_with_arguments_of_the_wrong_type(tmp_path):
+    status,report=check(tmp_path,'theorem T\na [x]\ne 1,"a"\nend\ntheorem U\na [x]\nd 1,[],-2\nend\n'
+                                 'theorem V\na [x]\ne 1\ns\nend\n')
+    assert status==2 and report['status']==2
+    invalid=report['files'][0]['invalid']
+    assert [x['line'] for x in invalid]==[3,7]
+    assert [(x['name'],x['statement']) for x in report['files'][0]['propositions']]==[('T','[]'),('V','[[x]:[[x]=[x]]]')]
+